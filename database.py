@@ -1,6 +1,9 @@
 import os
 from sqlmodel import create_engine, Session, SQLModel
-from sqlalchemy import event
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from psycopg_pool import AsyncConnectionPool
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -18,16 +21,87 @@ if postgres_url.startswith("postgres://"):
 
 engine = create_engine(postgres_url, echo=True)
 
+# Motor asíncrono (psycopg 3) para las rutas que no deben bloquear el event loop
+async_postgres_url = postgres_url.replace("postgresql://", "postgresql+psycopg://", 1)
+async_engine = create_async_engine(async_postgres_url, echo=True)
+
+# Pool compartido de psycopg para accesos directos sin ORM (historial de chat)
+# Se abre en el startup de la app y se cierra en el shutdown
+pg_pool = AsyncConnectionPool(
+  postgres_url,
+  min_size=int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+  max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+  open=False
+)
+
+
 @event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
 def set_search_path(dbapi_connection, connection_record):
     cursor = dbapi_connection.cursor()
     cursor.execute("SET search_path TO public")
     cursor.close()
 
+# create_all no agrega columnas ni índices a tablas que ya existen, así que
+# los cambios de esquema posteriores se aplican aquí de forma idempotente
+SCHEMA_UPDATES = [
+  "ALTER TABLE queries_log ADD COLUMN IF NOT EXISTS query_embedding vector(768)",
+  "ALTER TABLE queries_log ADD COLUMN IF NOT EXISTS is_cached BOOLEAN NOT NULL DEFAULT FALSE",
+  "ALTER TABLE queries_log ADD COLUMN IF NOT EXISTS first_token_time DOUBLE PRECISION",
+  "ALTER TABLE queries_log ADD COLUMN IF NOT EXISTS stage_timings JSONB",
+  "ALTER TABLE services ADD COLUMN IF NOT EXISTS knowledge_updated_at TIMESTAMP WITHOUT TIME ZONE",
+  "CREATE INDEX IF NOT EXISTS ix_queries_log_query_embedding ON queries_log USING hnsw (query_embedding vector_cosine_ops)",
+  "ALTER TABLE services ADD COLUMN IF NOT EXISTS retrieval_mode VARCHAR NOT NULL DEFAULT 'vector'",
+  # Full-text search para la búsqueda híbrida (códigos de transacción, números de error, T-codes)
+  "ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS content_tsv tsvector "
+  "GENERATED ALWAYS AS (to_tsvector('spanish', content)) STORED",
+  "CREATE INDEX IF NOT EXISTS ix_document_chunks_content_tsv ON document_chunks USING gin (content_tsv)",
+  # service_id desnormalizado en los chunks (búsqueda sin JOIN + índices HNSW parciales por servicio)
+  "ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS service_id INTEGER REFERENCES services (id)",
+  "CREATE INDEX IF NOT EXISTS ix_document_chunks_service_id ON document_chunks (service_id)",
+  "UPDATE document_chunks SET service_id = documents.service_id FROM documents "
+  "WHERE documents.id = document_chunks.document_id AND document_chunks.service_id IS NULL",
+  "ALTER TABLE services ADD COLUMN IF NOT EXISTS hnsw_ef_search INTEGER",
+  "ALTER TABLE services ADD COLUMN IF NOT EXISTS hnsw_iterative_scan VARCHAR",
+  # Checkpoint por página de la ingesta
+  "ALTER TABLE documents ADD COLUMN IF NOT EXISTS processed_pages INTEGER NOT NULL DEFAULT 0",
+  # Cargas masivas (upload_batches la crea create_all)
+  "ALTER TABLE documents ADD COLUMN IF NOT EXISTS batch_id UUID REFERENCES upload_batches (id)",
+  "CREATE INDEX IF NOT EXISTS ix_documents_batch_id ON documents (batch_id)",
+  # Un solo trabajo activo por documento: se cierran los duplicados previos y se agrega el índice único
+  "UPDATE ingestion_jobs SET status = 'FAILED', last_error = 'Trabajo duplicado', locked_until = NULL "
+  "WHERE status IN ('QUEUED', 'RUNNING') AND id NOT IN ("
+  "SELECT min(id) FROM ingestion_jobs WHERE status IN ('QUEUED', 'RUNNING') GROUP BY document_id)",
+  "CREATE UNIQUE INDEX IF NOT EXISTS ux_ingestion_jobs_active_document ON ingestion_jobs (document_id) "
+  "WHERE status IN ('QUEUED', 'RUNNING')",
+  # hnsw_iterative_scan aceptaba cualquier texto: los valores inválidos vuelven al del entorno
+  "UPDATE services SET hnsw_iterative_scan = NULL "
+  "WHERE hnsw_iterative_scan NOT IN ('off', 'strict_order', 'relaxed_order')",
+  "CREATE INDEX IF NOT EXISTS ix_query_embeddings_cache_created_at ON query_embeddings_cache (created_at)",
+]
+
+
 def init_db():
   SQLModel.metadata.create_all(engine)
 
+  with engine.begin() as connection:
+    for statement in SCHEMA_UPDATES:
+      connection.execute(text(statement))
+
 
 def get_session():
   with Session(engine) as session:
     yield session
+
+
+async def open_pool():
+  await pg_pool.open()
+
+
+async def close_pool():
+  await pg_pool.close()
+
+
+async def get_async_session():
+  async with AsyncSession(async_engine) as session:
+    yield session
@@ -1,7 +1,10 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from database import init_db
-from routes import users, services, documents, chat, analytics, auth, categories
+from database import init_db, open_pool, close_pool
+from routes import users, services, documents, chat, analytics, auth, categories, metrics
+from services.chat_history import chat_history_store
+from services.history_compaction import history_compactor
+from services.write_behind import write_behind
 import os
 
 app = FastAPI(
@@ -24,8 +27,21 @@ app.add_middleware(
 
 # create table init app
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
   init_db()
+  # Los índices HNSW parciales los construye worker.py al iniciar, fuera del arranque de la API
+  await open_pool()
+  # El esquema del historial se crea una sola vez, no en cada pregunta
+  await chat_history_store.create_schema()
+  write_behind.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+  # La escritura diferida y las compactaciones usan el pool: se vacían antes de cerrarlo
+  await write_behind.close()
+  await history_compactor.close()
+  await close_pool()
 
 
 # Routes
@@ -36,3 +52,5 @@ app.include_router(chat.router, prefix="/api/v1")
 app.include_router(analytics.router, prefix="/api/v1")
 app.include_router(auth.router, prefix="/api/v1")
 app.include_router(categories.router, prefix="/api/v1")
+# Sin prefijo ni autenticación: es la ruta que consulta el scraper de Prometheus
+app.include_router(metrics.router)
@@ -4,5 +4,10 @@ from .document import Document
 from .chunk import DocumentChunk
 from .query_log import QueryLog
 from .category import Category
+from .query_embedding import QueryEmbedding
+from .ingestion_job import IngestionJob
+from .chunk_embedding import ChunkEmbedding
+from .upload_batch import UploadBatch
+from .ingestion_progress import IngestionProgress
 
-__all__ = ["User", "Service", "Document", "DocumentChunk", "QueryLog", "Category"]
+__all__ = ["User", "Service", "Document", "DocumentChunk", "QueryLog", "Category", "QueryEmbedding", "IngestionJob", "ChunkEmbedding", "UploadBatch", "IngestionProgress"]
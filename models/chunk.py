@@ -11,6 +11,8 @@ class DocumentChunk(SQLModel, table=True):
 
   id: UUID = Field(default_factory=uuid4, primary_key=True)
   document_id: UUID = Field(foreign_key="documents.id", ondelete="CASCADE")
+  # Copia de documents.service_id: permite filtrar sin JOIN y usar el índice HNSW parcial del servicio
+  service_id: Optional[int] = Field(default=None, foreign_key="services.id", index=True)
 
   content: str
   page_number: Optional[int] = None
@@ -0,0 +1,14 @@
+from typing import List
+from datetime import datetime
+from sqlmodel import SQLModel, Field
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import Column
+
+
+class ChunkEmbedding(SQLModel, table=True):
+  """Vector de un chunk de la ingesta, indexado por el sha256 de su task_type y su texto"""
+  __tablename__ = "chunk_embeddings_cache"
+
+  content_hash: str = Field(primary_key=True, max_length=64)
+  embedding: List[float] = Field(sa_column=Column(Vector(768)))
+  created_at: datetime = Field(default_factory=datetime.now)
@@ -26,6 +26,10 @@ class Document(DocumentBase, table=True):
   upload_date: datetime = Field(default_factory=datetime.now)
   status: DocumentStatus = Field(default=DocumentStatus.PENDING)
   deleted_at: Optional[datetime] = Field(default=None)
+  # Checkpoint de la ingesta: páginas ya guardadas (un reintento o reproceso sigue desde aquí)
+  processed_pages: int = Field(default=0)
+  # Carga masiva de la que vino el documento (None si se subió solo)
+  batch_id: Optional[UUID] = Field(default=None, foreign_key="upload_batches.id", index=True)
 
 
 class DocumentCreate(DocumentBase):
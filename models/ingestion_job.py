@@ -0,0 +1,31 @@
+from typing import Optional
+from datetime import datetime
+from enum import Enum
+from uuid import UUID
+from sqlalchemy import String
+from sqlmodel import SQLModel, Field
+
+
+class JobStatus(str, Enum):
+  QUEUED = "QUEUED"
+  RUNNING = "RUNNING"
+  DONE = "DONE"
+  FAILED = "FAILED"
+
+
+class IngestionJob(SQLModel, table=True):
+  """Trabajo de procesamiento de un documento, tomado por worker.py con FOR UPDATE SKIP LOCKED"""
+  __tablename__ = "ingestion_jobs"
+
+  id: Optional[int] = Field(default=None, primary_key=True)
+  document_id: UUID = Field(foreign_key="documents.id", index=True)
+  status: JobStatus = Field(default=JobStatus.QUEUED, sa_type=String, index=True)
+  attempts: int = Field(default=0)
+  # No se toma antes de esta fecha (backoff entre reintentos)
+  run_after: datetime = Field(default_factory=datetime.now)
+  # Visibility timeout: si el worker muere sin renovarlo, otro worker puede retomar el trabajo
+  locked_until: Optional[datetime] = None
+  locked_by: Optional[str] = None
+  last_error: Optional[str] = None
+  created_at: datetime = Field(default_factory=datetime.now)
+  updated_at: datetime = Field(default_factory=datetime.now)
@@ -0,0 +1,26 @@
+from typing import Optional
+from datetime import datetime
+from uuid import UUID
+from sqlmodel import SQLModel, Field
+
+
+class IngestionProgress(SQLModel, table=True):
+  """Contadores de la última ejecución de la ingesta de un documento (los actualiza worker.py)"""
+  __tablename__ = "ingestion_progress"
+
+  document_id: UUID = Field(foreign_key="documents.id", primary_key=True, ondelete="CASCADE")
+  pages_total: Optional[int] = None
+  pages_parsed: int = Field(default=0)
+  chunks_produced: int = Field(default=0)
+  chunks_embedded: int = Field(default=0)
+  rows_written: int = Field(default=0)
+
+  # Segundos que cada etapa del pipeline estuvo ocupada (las etapas corren solapadas)
+  extract_seconds: float = Field(default=0.0)
+  split_seconds: float = Field(default=0.0)
+  embed_seconds: float = Field(default=0.0)
+  write_seconds: float = Field(default=0.0)
+
+  started_at: datetime = Field(default_factory=datetime.now)
+  updated_at: datetime = Field(default_factory=datetime.now)
+  finished_at: Optional[datetime] = None
@@ -0,0 +1,15 @@
+from typing import List
+from datetime import datetime
+from sqlmodel import SQLModel, Field
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import Column
+
+
+class QueryEmbedding(SQLModel, table=True):
+  """Vector de una pregunta ya normalizada, compartido entre workers"""
+  __tablename__ = "query_embeddings_cache"
+
+  question: str = Field(primary_key=True)
+  embedding: List[float] = Field(sa_column=Column(Vector(768)))
+  # Indexado: la limpieza borra por antigüedad (TTL y tope de filas)
+  created_at: datetime = Field(default_factory=datetime.now, index=True)
@@ -3,6 +3,8 @@ from sqlmodel import SQLModel, Field
 from uuid import UUID, uuid4
 from datetime import datetime
 from sqlalchemy import Column, ARRAY, String
+from sqlalchemy.dialects.postgresql import JSONB
+from pgvector.sqlalchemy import Vector
 
 
 class QueryLog(SQLModel, table=True):
@@ -14,4 +16,11 @@ class QueryLog(SQLModel, table=True):
   answer_text: str
   context_chunks_ids: Optional[List[str]] = Field(default=None, sa_column=Column(ARRAY(String)))
   response_time: Optional[float] = None
+  # Segundos hasta que el cliente recibe el primer token (latencia percibida)
+  first_token_time: Optional[float] = None
+  # Vector de la pregunta, usado por la caché semántica de respuestas
+  query_embedding: Optional[List[float]] = Field(default=None, sa_column=Column(Vector(768)))
+  is_cached: bool = Field(default=False)
+  # Segundos por etapa: embed, retrieve, history_load, llm (la escritura en lote se mide aparte)
+  stage_timings: Optional[dict] = Field(default=None, sa_column=Column(JSONB))
   created_at: datetime = Field(default_factory=datetime.now)
@@ -1,9 +1,25 @@
 from typing import Optional
 from datetime import datetime
+from enum import Enum
+from sqlalchemy import String
 from sqlmodel import SQLModel, Field, Relationship
 from models.category import Category
 
 
+class RetrievalMode(str, Enum):
+  VECTOR = "vector"
+  HYBRID = "hybrid"
+  # Índice en memoria (archivos mmap por servicio); Postgres sigue siendo la fuente de verdad
+  MEMORY = "memory"
+
+
+class IterativeScan(str, Enum):
+  """Valores de hnsw.iterative_scan de pgvector (>= 0.8)"""
+  OFF = "off"
+  STRICT_ORDER = "strict_order"
+  RELAXED_ORDER = "relaxed_order"
+
+
 class ServiceBase(SQLModel):
   name: str = Field(unique=True, index=True)
   description: Optional[str] = None
@@ -11,12 +27,20 @@ class ServiceBase(SQLModel):
   # Category
   category_id: int = Field(foreign_key="categories.id")
 
+  # Búsqueda usada en el chat: vectorial, híbrida (vectorial + full-text con RRF) o en memoria
+  retrieval_mode: RetrievalMode = Field(default=RetrievalMode.VECTOR, sa_type=String)
+  # Parámetros HNSW por servicio (None = valores por defecto del entorno)
+  hnsw_ef_search: Optional[int] = None
+  hnsw_iterative_scan: Optional[IterativeScan] = Field(default=None, sa_type=String)
+
 
 class Service(ServiceBase, table=True):
   __tablename__ = "services"
   id: Optional[int] = Field(default=None, primary_key=True)
   status: bool = Field(default=True)
   deleted_at: Optional[datetime] = Field(default=None)
+  # Última vez que cambiaron sus documentos: invalida las respuestas cacheadas anteriores
+  knowledge_updated_at: Optional[datetime] = Field(default=None)
 
   category: Optional[Category] = Relationship(back_populates="services")
 
@@ -30,3 +54,6 @@ class ServiceUpdate(SQLModel):
   description: Optional[str] = None
   category_id: Optional[int] = None
   status: Optional[bool] = None
+  retrieval_mode: Optional[RetrievalMode] = None
+  hnsw_ef_search: Optional[int] = None
+  hnsw_iterative_scan: Optional[IterativeScan] = None
@@ -0,0 +1,15 @@
+from typing import Optional
+from datetime import datetime
+from uuid import UUID, uuid4
+from sqlmodel import SQLModel, Field
+
+
+class UploadBatch(SQLModel, table=True):
+  """Carga masiva de documentos: agrupa los Document subidos en un mismo request"""
+  __tablename__ = "upload_batches"
+
+  id: UUID = Field(default_factory=uuid4, primary_key=True)
+  service_id: int = Field(foreign_key="services.id")
+  total_documents: int = Field(default=0)
+  created_by: Optional[UUID] = Field(default=None, foreign_key="users.id")
+  created_at: datetime = Field(default_factory=datetime.now)
@@ -1,12 +1,17 @@
+from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends
 from sqlmodel import Session, select
-from sqlalchemy import func
+from sqlalchemy import extract, func
 from database import get_session
 from models.query_log import QueryLog
 from models.services import Service
 from models.users import User
 from security import get_current_user
 from models.document import Document
+from models.ingestion_progress import IngestionProgress
+from services.embedding_cache import query_embedding_cache
+from services.write_behind import write_behind
+from services.single_flight import single_flight
 import os
 
 router = APIRouter(prefix="/analytics", tags=["Analytics"])
@@ -21,6 +26,10 @@ def get_dashboard_metrics(session: Session = Depends(get_session), current_user:
   avg_time = session.exec(select(func.avg(QueryLog.response_time))).one()
   avg_time = round(avg_time, 2) if avg_time else 0.0
 
+  # Tiempo promedio hasta el primer token (lo que el usuario percibe)
+  avg_first_token = session.exec(select(func.avg(QueryLog.first_token_time))).one()
+  avg_first_token = round(avg_first_token, 2) if avg_first_token else 0.0
+
   # 3. Consultas agrupadas por Servicio (Ej: Cuántas a SAP, cuántas a VPN)
   # Hacemos un JOIN entre servicios y logs, y agrupamos
   statement_by_service = (
@@ -41,7 +50,8 @@ def get_dashboard_metrics(session: Session = Depends(get_session), current_user:
   return {
     "overview": {
       "total_queries": total_queries,
-      "average_response_time_seconds": avg_time
+      "average_response_time_seconds": avg_time,
+      "average_first_token_time_seconds": avg_first_token
     },
     "usage_by_service": [
       {
@@ -89,5 +99,55 @@ def get_system_health(session: Session = Depends(get_session), current_user: Use
     "ai_status": ai_status,
     "total_documents": total_docs or 0,
     "last_sync": last_sync_date.isoformat() if last_sync_date else None,
-    "failed_documents": failed_docs or 0
+    "failed_documents": failed_docs or 0,
+    "query_embedding_cache": query_embedding_cache.stats(),
+    "write_behind": write_behind.stats(),
+    "single_flight": single_flight.stats()
+  }
+
+
+@router.get("/ingestion-throughput")
+def get_ingestion_throughput(
+  hours: int = 24,
+  session: Session = Depends(get_session),
+  current_user: User = Depends(get_current_user)
+):
+  """Rendimiento agregado de la ingesta en las últimas `hours` horas (para planificar capacidad)"""
+  since = datetime.now() - timedelta(hours=hours)
+  wall_seconds = extract("epoch", IngestionProgress.finished_at - IngestionProgress.started_at)
+
+  documents, pages, chunks, embedded, rows, wall, extract_s, split_s, embed_s, write_s = session.exec(
+    select(
+      func.count(IngestionProgress.document_id),
+      func.coalesce(func.sum(IngestionProgress.pages_parsed), 0),
+      func.coalesce(func.sum(IngestionProgress.chunks_produced), 0),
+      func.coalesce(func.sum(IngestionProgress.chunks_embedded), 0),
+      func.coalesce(func.sum(IngestionProgress.rows_written), 0),
+      func.coalesce(func.sum(wall_seconds), 0),
+      func.coalesce(func.sum(IngestionProgress.extract_seconds), 0),
+      func.coalesce(func.sum(IngestionProgress.split_seconds), 0),
+      func.coalesce(func.sum(IngestionProgress.embed_seconds), 0),
+      func.coalesce(func.sum(IngestionProgress.write_seconds), 0)
+    ).where(IngestionProgress.finished_at >= since)
+  ).one()
+
+  wall = float(wall)
+  embed_s = float(embed_s)
+  return {
+    "hours": hours,
+    "documents": documents,
+    "pages_parsed": pages,
+    "chunks_produced": chunks,
+    "chunks_embedded": embedded,
+    "rows_written": rows,
+    "processing_seconds": round(wall, 2),
+    "stage_seconds": {
+      "extract": round(float(extract_s), 2),
+      "split": round(float(split_s), 2),
+      "embed": round(embed_s, 2),
+      "write": round(float(write_s), 2)
+    },
+    # Tiempos sumados por documento: con varios documentos en paralelo la capacidad total es mayor
+    "pages_per_second": round(pages / wall, 2) if wall else 0.0,
+    "embeddings_per_second": round(embedded / embed_s, 2) if embed_s else 0.0
   }
@@ -1,121 +1,394 @@
 from fastapi import APIRouter, Depends, HTTPException
-from langchain_postgres import PostgresChatMessageHistory
-import psycopg
-from sqlmodel import Session, select
-from database import get_session
-from models.chunk import DocumentChunk
-from models.document import Document
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from sqlmodel.ext.asyncio.session import AsyncSession
+from database import async_engine
 from models.query_log import QueryLog
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
+from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import SystemMessage, HumanMessage
+import asyncio
+import json
 import os
 import time
-from security import get_current_user
+from security import get_current_user, get_current_user_for_stream
+from services.embedding_cache import query_embedding_cache, normalize_question
+from services.answer_cache import find_cached_answer
+from services.chat_history import chat_history_store
+from services.write_behind import write_behind
+from services.single_flight import single_flight
+from services.sse import format_sse
+from services.metrics import StageTimer
+from services.retrieval import search_chunks, search_chunks_batch
+from services.context import assemble_context, CONTEXT_CANDIDATES
 from models.users import User
+from typing import Optional
 import uuid
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
-embeddings_model = GoogleGenerativeAIEmbeddings(model="gemini-embedding-001", output_dimensionality=768)
 llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite", temperature=0.0)
 
-DB_URL = os.getenv("DATABASE_URL")
+# Cantidad de mensajes previos que se envían a Gemini en cada pregunta
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "6"))
+NOT_FOUND_ANSWER = "Lo siento, no encontré información sobre eso en los manuales de este servicio."
+# Llamadas simultáneas a Gemini permitidas en /ask-batch
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
+
+class BatchQuestionsRequest(BaseModel):
+  service_id: int
+  questions: list[str] = Field(min_length=1, max_length=1000)
+
+
+def get_chat_session_id(user_id, service_id: int) -> str:
+  raw_session_string = f"user_{user_id}_service_{service_id}"
+  return str(uuid.uuid5(uuid.NAMESPACE_DNS, raw_session_string))
+
+
+def build_system_prompt(results, summary: Optional[str] = None) -> SystemMessage:
+  # Construir el contexto para Gemini
+  context_text = "\n\n".join([f"[Página {r.page_number}]: {r.content}" for r in results])
+
+  # Los turnos viejos de la conversación llegan resumidos, no como mensajes sueltos
+  summary_text = f"\n\nRESUMEN DE LA CONVERSACIÓN PREVIA:\n{summary}" if summary else ""
+
+  # Prompt de Sistema (Strict RAG)
+  return SystemMessage(content=(
+    "Eres un asistente técnico de soporte interno. Tu única fuente de verdad es el CONTEXTO proporcionado. "
+    "Si la respuesta no está en el contexto, di que no lo sabes. No inventes nada. "
+    f"CONTEXTO:\n{context_text}{summary_text}"
+  ))
+
+
+async def prepare_answer(service_id: int, question: str, use_cache: bool = True):
+  """
+  Vector de la pregunta, respuesta cacheada (si hay), contexto armado y tiempos de las etapas.
+  Se comparte entre requests idénticos simultáneos, por eso usa su propia sesión.
+  Con historial (`use_cache=False`) no se busca en la caché: la misma pregunta puede
+  significar otra cosa dentro de una conversación ("¿y en Windows?").
+  """
+  timer = StageTimer()
+
+  # 1. Convertir la pregunta del usuario en un Vector (las preguntas repetidas salen de la caché)
+  with timer.stage("embed"):
+    query_vector = await query_embedding_cache.embed_query(question)
+
+  with timer.stage("retrieve"):
+    async with AsyncSession(async_engine) as session:
+      # Caché semántica: si ya respondimos una pregunta equivalente para este servicio la reutilizamos
+      cached = await find_cached_answer(session, service_id, query_vector) if use_cache else None
+      if cached:
+        return query_vector, cached, [], timer.timings
+
+      # 2. Búsqueda en Postgres: se traen más candidatos de los que entran al prompt
+      candidates = await search_chunks(session, service_id, query_vector, question, limit=CONTEXT_CANDIDATES)
+
+    # 3. Contexto compacto: diversidad (MMR), sin solapamientos y dentro del presupuesto de tokens
+    results = assemble_context(candidates, query_vector)
+
+  return query_vector, None, results, timer.timings
+
+
+async def generate_answer(results, question: str) -> str:
+  """Respuesta sin historial: depende solo del servicio y la pregunta, se puede compartir"""
+  ai_response = await llm.ainvoke([build_system_prompt(results), HumanMessage(content=question)])
+  return ai_response.content
 
 
 @router.post("/ask")
 async def ask_chatbot(
   question: str,
   service_id: int,
-  session: Session = Depends(get_session),
   current_user: User = Depends(get_current_user)
 ):
   start_time = time.time()
+  timer = StageTimer()
 
   try:
-    # 1. Convertir la pregunta del usuario en un Vector
-    query_vector = embeddings_model.embed_query(question)
-
-    # 2. Búsqueda Vectorial en Postgres con "Hard Filter" de servicio
-    # Usamos una consulta SQL pura a través de session para aprovechar pgvector
-    # Buscamos los 5 fragmentos más parecidos que pertenezcan al servicio elegido
-    statement = (
-      select(DocumentChunk.id, DocumentChunk.content, DocumentChunk.page_number)
-      .join(Document, Document.id == DocumentChunk.document_id)
-      .where(Document.service_id == service_id)
-      .where(Document.deleted_at == None)
-      .where(DocumentChunk.deleted_at == None)
-      .order_by(DocumentChunk.embedding.cosine_distance(query_vector))
-      .limit(5)
-    )
+    session_id = get_chat_session_id(current_user.id, service_id)
+    normalized_question = normalize_question(question)
 
-    results = session.exec(statement).all()
+    # Historial: resumen de los turnos viejos + los mensajes más recientes. Se lee antes que la
+    # caché: una respuesta que dependió de la conversación no se reutiliza ni se ofrece a otros
+    with timer.stage("history_load"):
+      summary, previous_messages = await chat_history_store.get_recent_messages(session_id, CHAT_HISTORY_WINDOW)
+    standalone = not summary and not previous_messages
 
-    if not results:
-      return {"answer": "Lo siento, no encontré información sobre eso en los manuales de este servicio."}
-
-    # 3. Construir el contexto para Gemini
-    context_text = "\n\n".join([f"[Página {r.page_number}]: {r.content}" for r in results])
-
-    # 4. Prompt de Sistema (Strict RAG)
-    system_prompt = SystemMessage(content=(
-      "Eres un asistente técnico de soporte interno. Tu única fuente de verdad es el CONTEXTO proporcionado. "
-      "Si la respuesta no está en el contexto, di que no lo sabes. No inventes nada. "
-      f"CONTEXTO:\n{context_text}"
-    ))
-
-    # Creamos una conexión sincrónica exclusiva para el historial
-    sync_connection = psycopg.connect(DB_URL)
-    table_name = "langchain_chat_history"
-
-    raw_session_string = f"user_{current_user.id}_service_{service_id}"
-    session_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, raw_session_string))
+    # 1-3. Vector, caché semántica y contexto: los requests idénticos en curso comparten el trabajo
+    query_vector, cached, results, prepare_timings = await single_flight.do(
+      ("prepare", service_id, normalized_question, standalone),
+      lambda: prepare_answer(service_id, question, use_cache=standalone)
+    )
+    timer.timings.update(prepare_timings)
 
-    PostgresChatMessageHistory.create_tables(sync_connection, table_name)
+    if cached:
+      cached_log, sources = cached
+      await write_behind.add_exchange(session_id, question, cached_log.answer_text)
 
-    chat_history = PostgresChatMessageHistory(
-      table_name,
-      session_id,
-      sync_connection=sync_connection
-    )
+      response_time = round(time.time() - start_time, 2)
+      await write_behind.add_query_log(QueryLog(
+        user_id=current_user.id,
+        service_id=service_id,
+        query_text=question,
+        answer_text=cached_log.answer_text,
+        context_chunks_ids=cached_log.context_chunks_ids,
+        response_time=response_time,
+        first_token_time=response_time,
+        query_embedding=query_vector,
+        is_cached=True,
+        stage_timings=timer.timings
+      ))
+      timer.observe("ask")
 
-    previous_messages = chat_history.messages[-6:]
+      return {"answer": cached_log.answer_text, "sources": sources, "cached": True}
 
-    human_prompt = HumanMessage(content=question)
+    if not results:
+      return {"answer": NOT_FOUND_ANSWER}
 
-    # 5. Generar respuesta con Gemini
-    # El orden es vital: Sistema (Reglas+Contexto) -> Historial -> Nueva Pregunta
-    messages_to_send = [system_prompt] + previous_messages + [human_prompt]
-    ai_response = llm.invoke(messages_to_send)
+    # 4. Generar respuesta con Gemini
+    with timer.stage("llm"):
+      if standalone:
+        # Sin historial la respuesta no depende del usuario: una sola llamada para todos los idénticos
+        answer = await single_flight.do(
+          ("answer", service_id, normalized_question),
+          lambda: generate_answer(results, question)
+        )
+      else:
+        # El orden es vital: Sistema (Reglas+Contexto) -> Historial -> Nueva Pregunta
+        messages_to_send = [build_system_prompt(results, summary)] + previous_messages + [HumanMessage(content=question)]
+        answer = (await llm.ainvoke(messages_to_send)).content
 
     # --- GUARDAR EN MEMORIA PARA LA PRÓXIMA VEZ ---
-    chat_history.add_user_message(question)
-    chat_history.add_ai_message(ai_response.content)
-
-    sync_connection.commit()  # Aseguramos que se guarde en Postgres
-    sync_connection.close()
+    # Historial y log se escriben en lote en segundo plano, fuera del tiempo de respuesta
+    # (cada usuario guarda lo suyo aunque la respuesta haya sido compartida). Encolar no es una
+    # etapa del request: la escritura real la mide write_behind_flush_seconds
+    await write_behind.add_exchange(session_id, question, answer)
 
-    # 6. Calcular el tiempo de respuesta y guardamos los logs
+    # 5. Calcular el tiempo de respuesta y guardamos los logs
     end_time = time.time()
     response_time = round(end_time - start_time, 2)
 
-    chunk_ids = [str(r.id) for r in results]
+    chunk_ids = [chunk_id for r in results for chunk_id in r.chunk_ids]
 
     new_log = QueryLog(
       user_id=current_user.id,
       service_id=service_id,
       query_text=question,
-      answer_text=ai_response.content,
+      answer_text=answer,
       context_chunks_ids=chunk_ids,
-      response_time=response_time
+      response_time=response_time,
+      # Sin streaming el cliente recibe el primer token junto con la respuesta completa
+      first_token_time=response_time,
+      # Solo las respuestas sin historial quedan como candidatas de la caché semántica
+      query_embedding=query_vector if standalone else None,
+      stage_timings=timer.timings
     )
-    session.add(new_log)
-    session.commit()
+    await write_behind.add_query_log(new_log)
+    timer.observe("ask")
 
     return {
-      "answer": ai_response.content,
-      "sources": [{"page": r.page_number} for r in results]
+      "answer": answer,
+      "sources": [{"page": r.page_number} for r in results],
+      "cached": False
     }
 
   except Exception as e:
     print(f"Error en el Chat: {str(e)}")
     raise HTTPException(status_code=500, detail="Error al procesar la consulta")
+
+
+@router.post("/ask/stream")
+async def ask_chatbot_stream(
+  question: str,
+  service_id: int,
+  current_user: User = Depends(get_current_user_for_stream)
+):
+  """
+  Variante en streaming (SSE) de /ask: envía las fuentes apenas termina la búsqueda
+  y luego los tokens de Gemini a medida que llegan. Eventos: sources, token, done, error.
+  """
+  start_time = time.time()
+  timer = StageTimer()
+  user_id = current_user.id
+
+  try:
+    session_id = get_chat_session_id(user_id, service_id)
+
+    messages_to_send = None
+    answer = NOT_FOUND_ANSWER
+    chunk_ids = []
+    sources = []
+
+    # El historial va antes que la caché, igual que en /ask
+    with timer.stage("history_load"):
+      summary, previous_messages = await chat_history_store.get_recent_messages(session_id, CHAT_HISTORY_WINDOW)
+    standalone = not summary and not previous_messages
+
+    query_vector, cached, results, prepare_timings = await single_flight.do(
+      ("prepare", service_id, normalize_question(question), standalone),
+      lambda: prepare_answer(service_id, question, use_cache=standalone)
+    )
+    timer.timings.update(prepare_timings)
+
+    if cached:
+      cached_log, sources = cached
+      answer = cached_log.answer_text
+      chunk_ids = cached_log.context_chunks_ids
+    elif results:
+      messages_to_send = [build_system_prompt(results, summary)] + previous_messages + [HumanMessage(content=question)]
+      chunk_ids = [chunk_id for r in results for chunk_id in r.chunk_ids]
+      sources = [{"page": r.page_number} for r in results]
+
+  except Exception as e:
+    print(f"Error en el Chat: {str(e)}")
+    raise HTTPException(status_code=500, detail="Error al procesar la consulta")
+
+  async def event_stream():
+    yield format_sse("sources", {"sources": sources, "cached": bool(cached)})
+
+    try:
+      first_token_time = None
+
+      if messages_to_send is None:
+        # Respuesta cacheada o sin contexto: se envía completa como un único token
+        first_token_time = round(time.time() - start_time, 2)
+        yield format_sse("token", {"text": answer})
+        full_answer = answer
+      else:
+        answer_parts = []
+        with timer.stage("llm"):
+          async for chunk in llm.astream(messages_to_send):
+            text = str(chunk.text)
+            if not text:
+              continue
+            if first_token_time is None:
+              first_token_time = round(time.time() - start_time, 2)
+            answer_parts.append(text)
+            yield format_sse("token", {"text": text})
+        full_answer = "".join(answer_parts)
+
+      response_time = round(time.time() - start_time, 2)
+
+      # Igual que en /ask, las preguntas sin contexto no se guardan
+      if chunk_ids:
+        await write_behind.add_exchange(session_id, question, full_answer)
+        await write_behind.add_query_log(QueryLog(
+          user_id=user_id,
+          service_id=service_id,
+          query_text=question,
+          answer_text=full_answer,
+          context_chunks_ids=chunk_ids,
+          response_time=response_time,
+          first_token_time=first_token_time,
+          query_embedding=query_vector if standalone else None,
+          is_cached=bool(cached),
+          stage_timings=timer.timings
+        ))
+        timer.observe("ask_stream")
+
+      yield format_sse("done", {"response_time": response_time, "first_token_time": first_token_time})
+
+    except Exception as e:
+      print(f"Error en el Chat (stream): {str(e)}")
+      yield format_sse("error", {"detail": "Error al procesar la consulta"})
+
+  return StreamingResponse(
+    event_stream(),
+    media_type="text/event-stream",
+    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+  )
+
+
+@router.post("/ask-batch")
+async def ask_chatbot_batch(
+  batch: BatchQuestionsRequest,
+  current_user: User = Depends(get_current_user_for_stream)
+):
+  """
+  Responde muchas preguntas de un servicio (regresiones nocturnas, cargas masivas).
+  Vectoriza todo en una llamada, recupera el contexto de todas en una sola consulta y
+  devuelve NDJSON: una línea por respuesta, en el orden en que van terminando.
+  No usa historial ni caché semántica: cada pregunta se responde de forma independiente.
+  La sesión de base de datos solo vive durante la búsqueda, no mientras se transmite la respuesta.
+  """
+  user_id = current_user.id
+  service_id = batch.service_id
+  questions = batch.questions
+  # Vectorización y búsqueda son de todo el lote: cada log guarda esos tiempos más su llamada a Gemini
+  batch_timer = StageTimer()
+
+  try:
+    with batch_timer.stage("embed"):
+      query_vectors = await query_embedding_cache.embed_queries(questions)
+    with batch_timer.stage("retrieve"):
+      async with AsyncSession(async_engine) as session:
+        candidates_by_question = await search_chunks_batch(
+          session, service_id, query_vectors, questions, limit=CONTEXT_CANDIDATES
+        )
+      results_by_question = [
+        assemble_context(candidates, query_vector)
+        for candidates, query_vector in zip(candidates_by_question, query_vectors)
+      ]
+    batch_timer.observe("ask_batch")
+  except Exception as e:
+    print(f"Error en el Chat (batch): {str(e)}")
+    raise HTTPException(status_code=500, detail="Error al procesar las consultas")
+
+  semaphore = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+  async def answer_question(index: int) -> dict:
+    question = questions[index]
+    results = results_by_question[index]
+    start_time = time.time()
+
+    if not results:
+      return {"index": index, "question": question, "answer": NOT_FOUND_ANSWER, "sources": []}
+
+    timer = StageTimer()
+    try:
+      async with semaphore:
+        with timer.stage("llm"):
+          ai_response = await llm.ainvoke([build_system_prompt(results), HumanMessage(content=question)])
+    except Exception as e:
+      print(f"Error en el Chat (batch): {str(e)}")
+      return {"index": index, "question": question, "error": "Error al procesar la consulta"}
+
+    return {
+      "index": index,
+      "question": question,
+      "answer": ai_response.content,
+      "sources": [{"page": r.page_number} for r in results],
+      "chunk_ids": [chunk_id for r in results for chunk_id in r.chunk_ids],
+      "timer": timer,
+      "response_time": round(time.time() - start_time, 2)
+    }
+
+  async def result_stream():
+    tasks = [asyncio.create_task(answer_question(i)) for i in range(len(questions))]
+
+    try:
+      for next_done in asyncio.as_completed(tasks):
+        item = await next_done
+        chunk_ids = item.pop("chunk_ids", None)
+        timer = item.pop("timer", None)
+        if chunk_ids:
+          timer.observe("ask_batch")
+          await write_behind.add_query_log(QueryLog(
+            user_id=user_id,
+            service_id=service_id,
+            query_text=item["question"],
+            answer_text=item["answer"],
+            context_chunks_ids=chunk_ids,
+            response_time=item["response_time"],
+            first_token_time=item["response_time"],
+            query_embedding=query_vectors[item["index"]],
+            stage_timings={**batch_timer.timings, **timer.timings}
+          ))
+
+        yield json.dumps(item, ensure_ascii=False) + "\n"
+    finally:
+      # Si el cliente se desconecta no seguimos gastando cuota de Gemini
+      for task in tasks:
+        task.cancel()
+
+  return StreamingResponse(result_stream(), media_type="application/x-ndjson")
@@ -1,90 +1,64 @@
-from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks
-from sqlmodel import Session, select, delete
-from uuid import UUID
-from database import get_session
+import asyncio
+import os
+import zipfile
+from typing import List, Tuple
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
+from starlette.datastructures import Headers
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from uuid import UUID, uuid4
+from database import get_session, async_engine
 from models.document import Document, DocumentStatus
+from models.ingestion_progress import IngestionProgress
+from models.services import Service
+from models.upload_batch import UploadBatch
 from services.s3_service import s3_client
-import hashlib
 from models.users import User
-from security import get_current_user
+from security import get_current_user, get_current_user_for_stream
+from services.answer_cache import invalidate_answer_cache
+from services.vector_index import vector_index
+from services.job_queue import enqueue_ingestion
+from services.soft_delete import soft_delete_document
+from services.ingestion_progress import progress_payload
+from services.sse import format_sse
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from models.chunk import DocumentChunk
-import os
+router = APIRouter(prefix="/documents", tags=['Documents'])
 
-import tempfile  # Librería nativa de Python
-from langchain_community.document_loaders import PyPDFLoader
+# Carga masiva: PDFs por request y archivos subiéndose a S3 a la vez
+BULK_UPLOAD_MAX_FILES = int(os.getenv("BULK_UPLOAD_MAX_FILES", "200"))
+BULK_UPLOAD_CONCURRENCY = int(os.getenv("BULK_UPLOAD_CONCURRENCY", "4"))
+# Segundos entre lecturas del progreso en el stream SSE
+PROGRESS_STREAM_INTERVAL = float(os.getenv("PROGRESS_STREAM_INTERVAL", "1"))
 
-router = APIRouter(prefix="/documents", tags=['Documents'])
 
+async def store_upload(session: Session, file: UploadFile) -> Tuple[str, str]:
+  """
+  Sube el PDF a S3 por partes mientras calcula su MD5 y retorna (s3_key, hash_md5).
+  Como el hash se conoce al terminar, se sube a una ruta temporal: si el mismo PDF ya
+  estaba en S3 se descarta y se reutiliza esa ruta; si no, se mueve a documents/<md5>/.
+  """
+  staging_key = f"uploads/{uuid4()}/{file.filename}"
+  file_hash, _ = await s3_client.upload_stream(file, staging_key)
+
+  s3_key = session.exec(
+    select(Document.s3_key)
+    .where(Document.hash_md5 == file_hash)
+    .where(Document.s3_key.startswith(s3_client.content_prefix(file_hash)))
+    .limit(1)
+  ).first()
+
+  if s3_key:
+    await asyncio.to_thread(s3_client.delete_file, staging_key)
+  else:
+    s3_key = f"{s3_client.content_prefix(file_hash)}{file.filename}"
+    await asyncio.to_thread(s3_client.move_file, staging_key, s3_key)
 
-async def process_document_task(document_id: UUID, session_factory):
-  with session_factory() as session:
-    try:
-      db_doc = session.get(Document, document_id)
-      if not db_doc: return
-
-      db_doc.status = DocumentStatus.PROCESSING
-      session.add(db_doc)
-      session.commit()
-
-      # --- CAMBIO AQUÍ: Descargamos el archivo manualmente ---
-      # Creamos un archivo temporal para no llenar el disco del servidor
-      with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-        # Usamos tu cliente de boto3 para bajar el archivo de S3
-        s3_client.s3.download_fileobj(s3_client.bucket_name, db_doc.s3_key, tmp_file)
-        tmp_path = tmp_file.name
-
-      # Ahora usamos PyPDFLoader que NO pide 'unstructured' ni 'pi_heif'
-      loader = PyPDFLoader(tmp_path)
-      raw_documents = loader.load()
-
-      # Borrar el archivo temporal después de leerlo
-      if os.path.exists(tmp_path):
-        os.remove(tmp_path)
-      # --- FIN DEL CAMBIO ---
-
-      text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        add_start_index=True
-      )
-      chunks = text_splitter.split_documents(raw_documents)
-
-      embeddings_model = GoogleGenerativeAIEmbeddings(
-        model="gemini-embedding-001",
-        google_api_key=os.getenv("GOOGLE_API_KEY"),
-        output_dimensionality=768
-      )
-
-      for chunk in chunks:
-        vector = embeddings_model.embed_query(chunk.page_content)
-
-        new_chunk = DocumentChunk(
-          document_id=db_doc.id,
-          content=chunk.page_content,
-          page_number=chunk.metadata.get("page", 1),
-          embedding=vector
-        )
-        session.add(new_chunk)
-
-      db_doc.status = DocumentStatus.READY
-      session.add(db_doc)
-      session.commit()
-      print(f"Documento {document_id} procesado con éxito.")
-
-    except Exception as e:
-      print(f"Error procesando documento {document_id}: {str(e)}")
-      db_doc.status = DocumentStatus.ERROR
-      session.add(db_doc)
-      session.commit()
+  return s3_key, file_hash
 
 
 @router.post("/upload")
 async def upload_document(
-  background_tasks: BackgroundTasks,
   service_id: int = Form(...),
   title: str = Form(...),
   file: UploadFile = File(...),
@@ -95,12 +69,8 @@ async def upload_document(
     raise HTTPException(status_code=400, detail="El archivo debe ser un PDF")
 
   try:
-    file_content = await file.read()
-    file_hash = hashlib.md5(file_content).hexdigest()
-
-    await file.seek(0)
-
-    s3_key = s3_client.upload_file(file)
+    # La ingesta además copia los chunks del documento READY con el mismo hash en vez de reprocesarlo
+    s3_key, file_hash = await store_upload(session, file)
 
     new_doc = Document(
       title=title,
@@ -111,22 +81,156 @@ async def upload_document(
     )
 
     session.add(new_doc)
+    # El documento y su trabajo de ingesta se guardan juntos: worker.py lo toma de la cola
+    enqueue_ingestion(session, new_doc.id)
+    invalidate_answer_cache(session, service_id)
     session.commit()
     session.refresh(new_doc)
 
-    from database import engine
-    from sqlmodel import Session as SQLSession
+    return {"message": "Procesamiento iniciado", "document_id": new_doc.id}
 
-    def session_factory():
-      return SQLSession(engine)
+  except Exception as e:
+    raise HTTPException(status_code=500, detail=f"Error en el servidor: {str(e)}")
 
-    background_tasks.add_task(process_document_task, new_doc.id, session_factory)
 
-    return {"message": "Procesamiento iniciado", "document_id": new_doc.id}
+def expand_uploads(files: List[UploadFile]) -> List[UploadFile]:
+  """PDFs sueltos y los PDFs de dentro de cada ZIP (se leen del ZIP sin extraerlo a disco)"""
+  pdfs = []
+  for file in files:
+    name = file.filename.lower()
+    if name.endswith(".pdf"):
+      pdfs.append(file)
+    elif name.endswith(".zip"):
+      archive = zipfile.ZipFile(file.file)
+      for info in archive.infolist():
+        if info.is_dir() or not info.filename.lower().endswith(".pdf") or info.filename.startswith("__MACOSX/"):
+          continue
+        pdfs.append(UploadFile(
+          archive.open(info),
+          size=info.file_size,
+          filename=os.path.basename(info.filename),
+          headers=Headers({"content-type": "application/pdf"})
+        ))
+    else:
+      raise HTTPException(status_code=400, detail=f"Archivo no soportado: {file.filename} (solo PDF o ZIP)")
+  return pdfs
+
+
+@router.post("/upload-batch")
+async def upload_documents_batch(
+  service_id: int = Form(...),
+  files: List[UploadFile] = File(...),
+  session: Session = Depends(get_session),
+  current_user: User = Depends(get_current_user)
+):
+  """
+  Carga masiva: varios PDFs (o ZIPs con PDFs) en un solo request. Se suben a S3 con
+  BULK_UPLOAD_CONCURRENCY archivos a la vez, los Document y sus trabajos de ingesta se
+  guardan en una sola transacción y worker.py los procesa con su límite de concurrencia.
+  """
+  db_service = session.get(Service, service_id)
+  if not db_service or db_service.deleted_at is not None:
+    raise HTTPException(status_code=404, detail="Servicio no encontrado")
+
+  try:
+    pdfs = expand_uploads(files)
+  except zipfile.BadZipFile:
+    raise HTTPException(status_code=400, detail="El archivo ZIP no es válido")
+
+  if not pdfs:
+    raise HTTPException(status_code=400, detail="No se encontraron archivos PDF")
+  if len(pdfs) > BULK_UPLOAD_MAX_FILES:
+    raise HTTPException(status_code=400, detail=f"Máximo {BULK_UPLOAD_MAX_FILES} PDFs por carga")
+
+  slots = asyncio.Semaphore(BULK_UPLOAD_CONCURRENCY)
+
+  async def upload(file: UploadFile):
+    async with slots:
+      try:
+        return file, await store_upload(session, file), None
+      except Exception as e:
+        return file, None, str(e)
+
+  results = await asyncio.gather(*[upload(file) for file in pdfs])
+
+  batch = UploadBatch(service_id=service_id, created_by=current_user.id)
+  documents = []
+  failed = []
+  for file, stored, error in results:
+    if error:
+      failed.append({"filename": file.filename, "error": error})
+      continue
+
+    s3_key, file_hash = stored
+    documents.append(Document(
+      title=os.path.splitext(file.filename)[0],
+      service_id=service_id,
+      s3_key=s3_key,
+      hash_md5=file_hash,
+      status=DocumentStatus.PENDING,
+      batch_id=batch.id
+    ))
 
+  if not documents:
+    raise HTTPException(status_code=500, detail=f"No se pudo subir ningún archivo: {failed[0]['error']}")
+
+  try:
+    batch.total_documents = len(documents)
+    session.add(batch)
+    session.add_all(documents)
+    for document in documents:
+      enqueue_ingestion(session, document.id)
+    invalidate_answer_cache(session, service_id)
+    session.commit()
   except Exception as e:
     raise HTTPException(status_code=500, detail=f"Error en el servidor: {str(e)}")
 
+  return {
+    "message": "Carga masiva iniciada",
+    "batch_id": batch.id,
+    "documents": [{"document_id": document.id, "title": document.title} for document in documents],
+    "failed": failed
+  }
+
+
+@router.get("/batches/{batch_id}")
+def get_batch_progress(batch_id: UUID, session: Session = Depends(get_session),
+                       current_user: User = Depends(get_current_user)):
+  """Progreso agregado de una carga masiva (para consultar periódicamente desde la UI)"""
+  batch = session.get(UploadBatch, batch_id)
+  if not batch:
+    raise HTTPException(status_code=404, detail="Carga no encontrada")
+
+  documents = session.exec(
+    select(Document)
+    .where(Document.batch_id == batch_id, Document.deleted_at == None)
+    .order_by(Document.title)
+  ).all()
+
+  status_counts = {status.value: 0 for status in DocumentStatus}
+  for document in documents:
+    status_counts[document.status.value] += 1
+  finished = status_counts[DocumentStatus.READY.value] + status_counts[DocumentStatus.ERROR.value]
+
+  return {
+    "batch_id": batch.id,
+    "service_id": batch.service_id,
+    "created_at": batch.created_at,
+    "total": len(documents),
+    "status_counts": status_counts,
+    "progress": round(finished / len(documents), 4) if documents else 1.0,
+    "completed": finished == len(documents),
+    "documents": [
+      {
+        "document_id": document.id,
+        "title": document.title,
+        "status": document.status,
+        "processed_pages": document.processed_pages
+      }
+      for document in documents
+    ]
+  }
+
 
 @router.get("")
 def get_all_documents(session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
@@ -147,19 +251,14 @@ def delete_document(document_id: UUID, session: Session = Depends(get_session),
   if not db_doc or db_doc.deleted_at is not None:
     raise HTTPException(status_code=404, detail="Documento no encontrado")
 
-  now = datetime.now()
-  db_doc.deleted_at = now
-  session.add(db_doc)
-
-  # Soft delete associated chunks
-  chunks = session.exec(select(DocumentChunk).where(DocumentChunk.document_id == document_id, DocumentChunk.deleted_at == None)).all()
-  for chunk in chunks:
-    chunk.deleted_at = now
-    session.add(chunk)
-
+  service_id = db_doc.service_id
+  deleted = soft_delete_document(session, document_id)
+  invalidate_answer_cache(session, service_id)
   session.commit()
 
-  return {"message": "Documento y vectores de entrenamiento eliminados correctamente"}
+  vector_index.remove_documents(service_id, [document_id])
+
+  return {"message": "Documento y vectores de entrenamiento eliminados correctamente", "deleted": deleted}
 
 
 @router.get("/{document_id}/view")
@@ -185,10 +284,67 @@ def view_document(document_id: UUID, session: Session = Depends(get_session)):
     raise HTTPException(status_code=500, detail=f"Error al generar el enlace de S3: {str(e)}")
 
 
+@router.get("/{document_id}/progress")
+def get_document_progress(document_id: UUID, session: Session = Depends(get_session),
+                          current_user: User = Depends(get_current_user)):
+  """Contadores de la última ingesta del documento: páginas, chunks, filas y tiempo por etapa"""
+  db_doc = session.get(Document, document_id)
+  if not db_doc or db_doc.deleted_at is not None:
+    raise HTTPException(status_code=404, detail="Documento no encontrado")
+
+  progress = session.get(IngestionProgress, document_id)
+  if not progress:
+    # Todavía en la cola (o procesado antes de existir el seguimiento)
+    return {"document_id": str(document_id), "status": db_doc.status, "started_at": None}
+
+  return progress_payload(progress, db_doc.status)
+
+
+@router.get("/{document_id}/progress/stream")
+async def stream_document_progress(document_id: UUID, current_user: User = Depends(get_current_user_for_stream)):
+  """
+  SSE con el progreso del documento: un evento 'progress' cada vez que cambian los contadores
+  y 'done' cuando queda READY o ERROR. Lee la tabla que va actualizando worker.py.
+  """
+  async def read_progress():
+    async with AsyncSession(async_engine) as session:
+      db_doc = await session.get(Document, document_id)
+      progress = await session.get(IngestionProgress, document_id)
+    return db_doc, progress
+
+  db_doc, _ = await read_progress()
+  if not db_doc or db_doc.deleted_at is not None:
+    raise HTTPException(status_code=404, detail="Documento no encontrado")
+
+  async def event_stream():
+    last_update = None
+    while True:
+      db_doc, progress = await read_progress()
+      # El borrado es lógico: el estado queda en PENDING/PROCESSING y nunca llegaría a READY
+      if db_doc is None or db_doc.deleted_at is not None:
+        yield format_sse("error", {"detail": "Documento no encontrado"})
+        return
+
+      if progress and progress.updated_at != last_update:
+        last_update = progress.updated_at
+        yield format_sse("progress", progress_payload(progress, db_doc.status))
+
+      if db_doc.status in (DocumentStatus.READY, DocumentStatus.ERROR):
+        yield format_sse("done", {"status": db_doc.status.value})
+        return
+
+      await asyncio.sleep(PROGRESS_STREAM_INTERVAL)
+
+  return StreamingResponse(
+    event_stream(),
+    media_type="text/event-stream",
+    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+  )
+
+
 @router.post("/{document_id}/reprocess")
 async def reprocess_document(
   document_id: UUID,
-  background_tasks: BackgroundTasks,
   session: Session = Depends(get_session),
   current_user: User = Depends(get_current_user)
 ):
@@ -205,25 +361,18 @@ async def reprocess_document(
     raise HTTPException(status_code=400, detail="Solo se pueden reprocesar documentos en estado ERROR")
 
   try:
-    # 3. Limpiar fragmentos (chunks) huérfanos
-    # Si el proceso anterior falló por la mitad, borramos la basura para no duplicar datos
-    statement = delete(DocumentChunk).where(DocumentChunk.document_id == document_id)
-    session.exec(statement)
+    # 3. Los chunks de las páginas ya guardadas se conservan: la ingesta sigue desde
+    # Document.processed_pages y descarta sola lo que quedó a medias después del checkpoint
 
     # 4. Cambiamos el estado de vuelta a PENDING para la UI
     db_doc.status = DocumentStatus.PENDING
     session.add(db_doc)
+    # 5. Nuevo trabajo en la cola de ingesta (lo procesa worker.py)
+    enqueue_ingestion(session, db_doc.id)
+    invalidate_answer_cache(session, db_doc.service_id)
     session.commit()
 
-    # 5. Preparamos la fábrica de sesiones para el BackgroundTask (Igual que en upload)
-    from database import engine
-    from sqlmodel import Session as SQLSession
-
-    def session_factory():
-      return SQLSession(engine)
-
-    # 6. Reutilizamos tu función original enviándola al fondo
-    background_tasks.add_task(process_document_task, db_doc.id, session_factory)
+    vector_index.remove_documents(db_doc.service_id, [db_doc.id])
 
     return {"message": "Reprocesamiento iniciado", "document_id": db_doc.id}
 
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+# Registra los collectors al importar
+import services.metrics  # noqa: F401
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics")
+def get_metrics():
+  """Métricas en formato Prometheus: etapas del chat, pools de conexiones, cola diferida e ingesta"""
+  return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
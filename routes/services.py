@@ -1,13 +1,14 @@
 from typing import Optional
-from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException
 from sqlmodel import Session, select
 from database import get_session
-from models.services import Service, ServiceCreate, ServiceUpdate, ServiceBase
-from models.document import Document
-from models.chunk import DocumentChunk
+from models.services import Service, ServiceCreate, ServiceUpdate, ServiceBase, RetrievalMode
 from models.users import User
 from security import get_current_user
+from services.answer_cache import invalidate_answer_cache
+from services.retrieval import clear_retrieval_settings, drop_service_vector_index
+from services.vector_index import vector_index
+from services.soft_delete import soft_delete_service
 from models.category import CategoryBase
 
 router = APIRouter(prefix="/services", tags=['Services'])
@@ -35,6 +36,8 @@ def create_service(service_data: ServiceCreate, session: Session = Depends(get_s
   session.add(db_service)
   session.commit()
   session.refresh(db_service)
+
+  # Su índice HNSW parcial lo crea worker.py al procesar el primer documento, no este request
   return db_service
 
 
@@ -67,6 +70,14 @@ def update_service(service_id: int, service_data: ServiceUpdate, session: Sessio
   session.add(db_service)
   session.commit()
   session.refresh(db_service)
+  clear_retrieval_settings(service_id)
+
+  # El índice en memoria solo se mantiene para los servicios que lo usan
+  if "retrieval_mode" in update_data:
+    if db_service.retrieval_mode == RetrievalMode.MEMORY:
+      vector_index.rebuild_service(service_id)
+    else:
+      vector_index.drop_service(service_id)
   return db_service
 
 
@@ -78,21 +89,13 @@ def delete_service(service_id: int, session: Session = Depends(get_session),
   if not db_service or db_service.deleted_at is not None:
     raise HTTPException(status_code=404, detail="Service not found")
 
-  now = datetime.now()
-  db_service.deleted_at = now
-
-  # Soft delete associated documents and their chunks
-  documents = session.exec(select(Document).where(Document.service_id == service_id, Document.deleted_at == None)).all()
-  for doc in documents:
-    doc.deleted_at = now
-    session.add(doc)
-    chunks = session.exec(select(DocumentChunk).where(DocumentChunk.document_id == doc.id, DocumentChunk.deleted_at == None)).all()
-    for chunk in chunks:
-      chunk.deleted_at = now
-      session.add(chunk)
-
-  session.add(db_service)
+  service_name = db_service.name
+  deleted = soft_delete_service(session, service_id)
+  invalidate_answer_cache(session, service_id)
   session.commit()
+  drop_service_vector_index(service_id)
+  vector_index.drop_service(service_id)
   return {
-    "message": f"Service '{db_service.name}' deleted"
+    "message": f"Service '{service_name}' deleted",
+    "deleted": deleted
   }
@@ -0,0 +1,351 @@
+"""
+Evaluación offline de la búsqueda: recall@k, MRR y latencia p50/p95 por combinación de parámetros.
+
+Corre la búsqueda real (services.retrieval.search_chunks) contra un Postgres + pgvector local.
+Los vectores salen de un embedder determinístico local (HashingEmbeddings), así que no
+usa la red ni cuota de Gemini. Los números sirven para comparar parámetros entre sí,
+no como calidad absoluta del embedder de producción.
+
+Para cada combinación de chunk_size / chunk_overlap se crean servicios temporales "eval-*"
+con los PDFs del dataset, se arma el índice HNSW parcial con cada `m` y se barren
+limit, ef_search y modo de búsqueda. Al terminar se borra todo lo que se creó.
+
+Uso (desde la raíz del proyecto, con DATABASE_URL apuntando a la base local):
+
+  python -m scripts.eval_retrieval dataset.json --limits 3,5,10 --ef-search 40,100 \\
+    --m 16,32 --chunk-sizes 500,1000 --overlaps 100,200 --modes vector,hybrid --output resultados.csv
+
+Formato del dataset:
+
+  {
+    "documents": [{"service_id": 1, "path": "manuales/sap.pdf"}],
+    "questions": [
+      {"service_id": 1, "question": "¿Cómo creo un pedido en ME21N?", "expected_pages": [12]},
+      {"service_id": 1, "question": "Error VPN 809", "expected_text": "error 809"}
+    ]
+  }
+
+El texto se extrae y se divide igual que en la ingesta (services.pdf_extraction y services.chunking).
+expected_pages usa la misma numeración que DocumentChunk.page_number (desde 0, como PyPDFLoader).
+expected_text marca como relevante cualquier chunk que contenga ese texto (sin importar mayúsculas).
+"""
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import math
+import re
+import statistics
+import sys
+import time
+import uuid
+from itertools import product
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from sqlalchemy import func, text
+from sqlmodel import Session, delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from database import engine, async_engine
+from models.chunk import DocumentChunk
+from models.document import Document, DocumentStatus
+from models.services import Service, RetrievalMode
+from services.chunking import CHUNK_SIZE, CHUNK_OVERLAP, build_text_splitter, page_document
+from services.pdf_extraction import count_pages, extract_page_range
+from services.retrieval import (
+  search_chunks, clear_retrieval_settings, service_vector_index_name, HNSW_EF_CONSTRUCTION
+)
+
+
+class HashingEmbeddings(Embeddings):
+  """
+  Embedder determinístico (hashing trick): palabras, bigramas y trigramas de caracteres
+  proyectados a `dimensions` posiciones con signo. Mismo texto -> mismo vector, sin red.
+  """
+
+  def __init__(self, dimensions: int = 768):
+    self.dimensions = dimensions
+
+  def _features(self, text_value: str) -> List[str]:
+    words = re.findall(r"\w+", text_value.lower())
+    features = list(words)
+    features += [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+      padded = f"#{word}#"
+      features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+    return features
+
+  def _embed(self, text_value: str) -> List[float]:
+    vector = [0.0] * self.dimensions
+    for feature in self._features(text_value):
+      digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+      value = int.from_bytes(digest, "little")
+      vector[value % self.dimensions] += 1.0 if (value >> 63) & 1 else -1.0
+
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else vector
+
+  def embed_documents(self, texts: List[str]) -> List[List[float]]:
+    return [self._embed(text_value) for text_value in texts]
+
+  def embed_query(self, text_value: str) -> List[float]:
+    return self._embed(text_value)
+
+
+def load_pages(path: str) -> list:
+  """Páginas del PDF con la misma extracción que usa la ingesta"""
+  return [
+    page_document(path, page_index, text)
+    for page_index, text in extract_page_range(path, 0, count_pages(path))
+  ]
+
+
+def parse_list(value: str, cast=int) -> list:
+  return [cast(item.strip()) for item in value.split(",") if item.strip()]
+
+
+def percentile(values: List[float], pct: float) -> float:
+  ordered = sorted(values)
+  index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+  return ordered[index]
+
+
+def is_relevant(row, item: dict) -> bool:
+  if row.page_number in item.get("expected_pages", []):
+    return True
+  expected_text = item.get("expected_text")
+  return bool(expected_text) and expected_text.lower() in row.content.lower()
+
+
+def score_question(rows, item: dict):
+  """Recall (fracción de objetivos encontrados) y reciprocal rank del primer chunk relevante"""
+  targets = [("page", page) for page in item.get("expected_pages", [])]
+  if item.get("expected_text"):
+    targets.append(("text", item["expected_text"].lower()))
+
+  found = set()
+  reciprocal_rank = 0.0
+  for rank, row in enumerate(rows, start=1):
+    if not is_relevant(row, item):
+      continue
+    if not reciprocal_rank:
+      reciprocal_rank = 1.0 / rank
+    if row.page_number in item.get("expected_pages", []):
+      found.add(("page", row.page_number))
+    if item.get("expected_text") and item["expected_text"].lower() in row.content.lower():
+      found.add(("text", item["expected_text"].lower()))
+
+  recall = len(found) / len(targets) if targets else 0.0
+  return recall, reciprocal_rank
+
+
+class EvalCorpus:
+  """Servicios, documentos y chunks temporales de una combinación chunk_size / overlap"""
+
+  def __init__(self, embedder: Embeddings, pages_by_path: dict):
+    self.embedder = embedder
+    self.pages_by_path = pages_by_path
+    # service_id del dataset -> id del servicio temporal
+    self.service_map: dict = {}
+
+  def build(self, documents: List[dict], chunk_size: int, chunk_overlap: int):
+    splitter = build_text_splitter(chunk_size, chunk_overlap)
+    run_id = uuid.uuid4().hex[:8]
+
+    with Session(engine) as session:
+      for service_id in sorted({doc["service_id"] for doc in documents}):
+        source = session.get(Service, service_id)
+        if source is None:
+          raise SystemExit(f"El servicio {service_id} del dataset no existe en la base local")
+
+        eval_service = Service(
+          name=f"eval-{run_id}-{service_id}-{chunk_size}-{chunk_overlap}",
+          description="Servicio temporal de scripts/eval_retrieval.py",
+          category_id=source.category_id
+        )
+        session.add(eval_service)
+        session.flush()
+        self.service_map[service_id] = eval_service.id
+
+      for doc in documents:
+        eval_service_id = self.service_map[doc["service_id"]]
+        db_doc = Document(
+          title=doc["path"],
+          service_id=eval_service_id,
+          s3_key=f"eval/{doc['path']}",
+          status=DocumentStatus.READY
+        )
+        session.add(db_doc)
+        session.flush()
+
+        chunks = splitter.split_documents(self.pages_by_path[doc["path"]])
+        vectors = self.embedder.embed_documents([chunk.page_content for chunk in chunks])
+        session.add_all([
+          DocumentChunk(
+            document_id=db_doc.id,
+            service_id=eval_service_id,
+            content=chunk.page_content,
+            page_number=chunk.metadata.get("page", 1),
+            embedding=vector
+          )
+          for chunk, vector in zip(chunks, vectors)
+        ])
+
+      session.commit()
+
+  def build_indexes(self, m: int):
+    """Índice HNSW parcial por servicio temporal con el `m` de esta combinación"""
+    with engine.begin() as connection:
+      for eval_service_id in self.service_map.values():
+        index_name = service_vector_index_name(eval_service_id)
+        connection.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+        connection.execute(text(
+          f"CREATE INDEX {index_name} ON document_chunks USING hnsw (embedding vector_cosine_ops) "
+          f"WITH (m = {int(m)}, ef_construction = {HNSW_EF_CONSTRUCTION}) "
+          f"WHERE service_id = {int(eval_service_id)} AND deleted_at IS NULL"
+        ))
+      connection.execute(text("ANALYZE document_chunks"))
+
+  def set_mode(self, mode: RetrievalMode):
+    with Session(engine) as session:
+      for eval_service_id in self.service_map.values():
+        service = session.get(Service, eval_service_id)
+        service.retrieval_mode = mode
+        session.add(service)
+      session.commit()
+
+    # search_chunks guarda la configuración de cada servicio en memoria: sin esto se mediría el modo anterior
+    for eval_service_id in self.service_map.values():
+      clear_retrieval_settings(eval_service_id)
+
+  def cleanup(self):
+    eval_ids = list(self.service_map.values())
+    if not eval_ids:
+      return
+
+    with engine.begin() as connection:
+      for eval_service_id in eval_ids:
+        connection.execute(text(f"DROP INDEX IF EXISTS {service_vector_index_name(eval_service_id)}"))
+
+    with Session(engine) as session:
+      session.exec(delete(DocumentChunk).where(DocumentChunk.service_id.in_(eval_ids)))
+      session.exec(delete(Document).where(Document.service_id.in_(eval_ids)))
+      session.exec(delete(Service).where(Service.id.in_(eval_ids)))
+      session.commit()
+    self.service_map = {}
+
+
+async def run_questions(corpus: EvalCorpus, questions: List[dict], query_vectors: List[List[float]],
+                        limit: int, ef_search: int, force_index: bool) -> dict:
+  recalls, reciprocal_ranks, latencies = [], [], []
+
+  for item, query_vector in zip(questions, query_vectors):
+    eval_service_id = corpus.service_map[item["service_id"]]
+
+    async with AsyncSession(async_engine) as session:
+      if force_index:
+        # Con corpus chicos el planner prefiere el seq scan y ef_search no tendría efecto
+        await session.exec(select(func.set_config("enable_seqscan", "off", True)))
+
+      start = time.perf_counter()
+      rows = await search_chunks(session, eval_service_id, query_vector, item["question"], limit=limit, ef_search=ef_search)
+      latencies.append((time.perf_counter() - start) * 1000)
+
+    recall, reciprocal_rank = score_question(rows, item)
+    recalls.append(recall)
+    reciprocal_ranks.append(reciprocal_rank)
+
+  return {
+    "recall_at_k": round(statistics.mean(recalls), 4),
+    "mrr": round(statistics.mean(reciprocal_ranks), 4),
+    "p50_ms": round(percentile(latencies, 50), 2),
+    "p95_ms": round(percentile(latencies, 95), 2)
+  }
+
+
+async def main(args):
+  with open(args.dataset) as dataset_file:
+    dataset = json.load(dataset_file)
+
+  documents = dataset["documents"]
+  questions = dataset["questions"]
+  missing = {item["service_id"] for item in questions} - {doc["service_id"] for doc in documents}
+  if missing:
+    raise SystemExit(f"Hay preguntas de servicios sin documentos en el dataset: {sorted(missing)}")
+
+  # Sin el log de cada consulta SQL (database.py crea los motores con echo=True)
+  engine.echo = False
+  async_engine.sync_engine.echo = False
+
+  embedder = HashingEmbeddings()
+  pages_by_path = {doc["path"]: load_pages(doc["path"]) for doc in documents}
+  query_vectors = embedder.embed_documents([item["question"] for item in questions])
+
+  modes = [RetrievalMode(mode) for mode in parse_list(args.modes, str)]
+  results = []
+
+  for chunk_size, chunk_overlap in product(parse_list(args.chunk_sizes), parse_list(args.overlaps)):
+    if chunk_overlap >= chunk_size:
+      continue
+
+    corpus = EvalCorpus(embedder, pages_by_path)
+    try:
+      corpus.build(documents, chunk_size, chunk_overlap)
+
+      for m in parse_list(args.m):
+        corpus.build_indexes(m)
+
+        for mode in modes:
+          corpus.set_mode(mode)
+
+          for ef_search, limit in product(parse_list(args.ef_search), parse_list(args.limits)):
+            # Primera pasada sin medir: caché de la configuración del servicio y páginas del índice en memoria
+            await run_questions(corpus, questions, query_vectors, limit, ef_search, args.force_index)
+            metrics = await run_questions(corpus, questions, query_vectors, limit, ef_search, args.force_index)
+
+            row = {
+              "chunk_size": chunk_size,
+              "chunk_overlap": chunk_overlap,
+              "m": m,
+              "mode": mode.value,
+              "ef_search": ef_search,
+              "limit": limit,
+              **metrics
+            }
+            results.append(row)
+            print(
+              f"chunk={chunk_size}/{chunk_overlap} m={m} mode={mode.value} ef_search={ef_search} limit={limit} "
+              f"recall@k={metrics['recall_at_k']:.3f} mrr={metrics['mrr']:.3f} "
+              f"p50={metrics['p50_ms']:.1f}ms p95={metrics['p95_ms']:.1f}ms"
+            )
+    finally:
+      corpus.cleanup()
+
+  if args.output and results:
+    with open(args.output, "w", newline="") as output_file:
+      writer = csv.DictWriter(output_file, fieldnames=list(results[0].keys()))
+      writer.writeheader()
+      writer.writerows(results)
+    print(f"Resultados guardados en {args.output}")
+
+  await async_engine.dispose()
+
+
+def build_parser() -> argparse.ArgumentParser:
+  parser = argparse.ArgumentParser(description="Barrido offline de parámetros de búsqueda (recall@k, MRR, latencia)")
+  parser.add_argument("dataset", help="JSON con documents y questions etiquetadas")
+  parser.add_argument("--limits", default="5", help="Valores de k separados por coma")
+  parser.add_argument("--ef-search", default="40", help="Valores de hnsw.ef_search")
+  parser.add_argument("--m", default="16", help="Valores de m para construir el índice HNSW")
+  parser.add_argument("--chunk-sizes", default=str(CHUNK_SIZE), help="Valores de chunk_size del splitter")
+  parser.add_argument("--overlaps", default=str(CHUNK_OVERLAP), help="Valores de chunk_overlap del splitter")
+  parser.add_argument("--modes", default="vector", help="Modos de búsqueda en Postgres: vector, hybrid")
+  parser.add_argument("--force-index", action="store_true", help="Desactiva el seq scan para medir el índice HNSW")
+  parser.add_argument("--output", help="Archivo CSV con los resultados")
+  return parser
+
+
+if __name__ == "__main__":
+  asyncio.run(main(build_parser().parse_args(sys.argv[1:])))
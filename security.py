@@ -4,7 +4,7 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlmodel import Session
 from jwt.exceptions import InvalidTokenError
-from database import get_session
+from database import engine, get_session
 from models.users import User
 
 import jwt
@@ -44,7 +44,20 @@ def get_current_user(
   session: Session = Depends(get_session)
 ) -> User:
   """Dependencia para validar el JWT y obtener el usuario actual"""
+  return _load_user(token, session)
 
+
+def get_current_user_for_stream(token: HTTPAuthorizationCredentials = Depends(token_auth_scheme)) -> User:
+  """
+  Igual que get_current_user pero para respuestas en streaming: la sesión se cierra apenas se
+  carga el usuario. Las dependencias con yield (get_session) se cierran recién cuando termina
+  la respuesta, así que cada stream abierto retendría una conexión del pool.
+  """
+  with Session(engine) as session:
+    return _load_user(token, session)
+
+
+def _load_user(token: HTTPAuthorizationCredentials, session: Session) -> User:
   credentials_exception = HTTPException(
     status_code=status.HTTP_401_UNAUTHORIZED,
     detail="No se pudieron validar las credenciales",
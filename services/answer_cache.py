@@ -0,0 +1,78 @@
+import os
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import or_, update
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models.chunk import DocumentChunk
+from models.query_log import QueryLog
+from models.services import Service
+
+load_dotenv()
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+# Similitud coseno mínima para considerar que dos preguntas son la misma
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+
+async def find_cached_answer(
+  session: AsyncSession,
+  service_id: int,
+  query_vector: List[float]
+) -> Optional[Tuple[QueryLog, list]]:
+  """
+  Busca en queries_log una respuesta ya generada para una pregunta equivalente del mismo servicio.
+  Solo se consideran respuestas posteriores al último cambio de documentos del servicio.
+  Retorna el log original y sus fuentes, o None si no hay una respuesta reutilizable.
+  """
+  if not ANSWER_CACHE_ENABLED:
+    return None
+
+  distance = QueryLog.query_embedding.cosine_distance(query_vector)
+  statement = (
+    select(QueryLog)
+    .join(Service, Service.id == QueryLog.service_id)
+    .where(QueryLog.service_id == service_id)
+    .where(QueryLog.is_cached == False)
+    .where(QueryLog.query_embedding != None)
+    .where(or_(Service.knowledge_updated_at == None, QueryLog.created_at > Service.knowledge_updated_at))
+    .where(distance <= 1 - ANSWER_CACHE_SIMILARITY)
+    .order_by(distance)
+    .limit(1)
+  )
+  cached_log = (await session.exec(statement)).first()
+
+  if not cached_log or not cached_log.context_chunks_ids:
+    return None
+
+  # Las fuentes se reconstruyen desde los chunks; si alguno ya no existe, la respuesta no sirve
+  chunks = (await session.exec(
+    select(DocumentChunk.id, DocumentChunk.page_number)
+    .where(DocumentChunk.id.in_(cached_log.context_chunks_ids))
+    .where(DocumentChunk.deleted_at == None)
+  )).all()
+
+  pages_by_id = {str(chunk.id): chunk.page_number for chunk in chunks}
+  if len(pages_by_id) != len(cached_log.context_chunks_ids):
+    return None
+
+  # Los chunks fusionados en un mismo pasaje comparten página: una fuente por página
+  pages = []
+  for chunk_id in cached_log.context_chunks_ids:
+    if pages_by_id[chunk_id] not in pages:
+      pages.append(pages_by_id[chunk_id])
+
+  sources = [{"page": page} for page in pages]
+  return cached_log, sources
+
+
+def invalidate_answer_cache(session: Session, service_id: int):
+  """Marca el cambio de conocimiento del servicio; el commit lo hace quien llama"""
+  session.exec(
+    update(Service)
+    .where(Service.id == service_id)
+    .values(knowledge_updated_at=datetime.now())
+  )
@@ -0,0 +1,82 @@
+import asyncio
+import os
+import random
+from typing import List
+
+from dotenv import load_dotenv
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+load_dotenv()
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+  """Gemini responde 429 / RESOURCE_EXHAUSTED cuando se agota la cuota por minuto"""
+  message = str(error)
+  return "429" in message or "RESOURCE_EXHAUSTED" in message or "ResourceExhausted" in type(error).__name__
+
+
+class BatchEmbedder:
+  """
+  Vectoriza los chunks de la ingesta en lotes de `batch_size` (embed_documents),
+  con hasta `concurrency` lotes en vuelo. Si un lote recibe un 429 se reintenta
+  solo ese lote con backoff exponencial (con jitter); los demás siguen su curso.
+  `task_type` es RETRIEVAL_QUERY, el que usaba embed_query al vectorizar chunks uno por uno:
+  todos los chunks de un servicio deben estar en el mismo espacio vectorial para compararse.
+  """
+
+  def __init__(
+    self,
+    embeddings: GoogleGenerativeAIEmbeddings,
+    batch_size: int = 100,
+    concurrency: int = 4,
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+    task_type: str = "RETRIEVAL_QUERY"
+  ):
+    self.embeddings = embeddings
+    self.task_type = task_type
+    self.batch_size = batch_size
+    self.concurrency = concurrency
+    self.max_retries = max_retries
+    self.base_delay = base_delay
+
+  async def embed(self, texts: List[str]) -> List[List[float]]:
+    """Retorna los vectores en el mismo orden que `texts`"""
+    semaphore = asyncio.Semaphore(self.concurrency)
+    batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+    async def embed_batch(batch: List[str]) -> List[List[float]]:
+      async with semaphore:
+        return await self._embed_with_retry(batch)
+
+    results = await asyncio.gather(*[embed_batch(batch) for batch in batches])
+    return [vector for batch_vectors in results for vector in batch_vectors]
+
+  async def _embed_with_retry(self, batch: List[str]) -> List[List[float]]:
+    for attempt in range(self.max_retries + 1):
+      try:
+        return await self.embeddings.aembed_documents(
+          batch,
+          batch_size=len(batch),
+          task_type=self.task_type
+        )
+      except Exception as e:
+        if not is_rate_limit_error(e) or attempt == self.max_retries:
+          raise
+        delay = self.base_delay * (2 ** attempt) * (1 + random.random())
+        print(f"Límite de cuota de Gemini en embeddings, reintento {attempt + 1} en {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+# Instancia global para la ingesta de documentos
+batch_embedder = BatchEmbedder(
+  GoogleGenerativeAIEmbeddings(
+    model="gemini-embedding-001",
+    google_api_key=os.getenv("GOOGLE_API_KEY"),
+    output_dimensionality=768
+  ),
+  batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "100")),
+  concurrency=int(os.getenv("EMBEDDING_CONCURRENCY", "4")),
+  max_retries=int(os.getenv("EMBEDDING_MAX_RETRIES", "5")),
+  base_delay=float(os.getenv("EMBEDDING_RETRY_BASE_DELAY", "1.0"))
+)
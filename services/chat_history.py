@@ -0,0 +1,137 @@
+import json
+from typing import List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, message_to_dict, messages_from_dict
+from psycopg import sql
+from psycopg_pool import AsyncConnectionPool
+
+from database import pg_pool
+
+
+class ChatHistoryStore:
+  """
+  Historial de chat sobre el pool compartido de conexiones.
+  Usa el mismo formato de tabla que PostgresChatMessageHistory (langchain_postgres),
+  así que las conversaciones que ya existen se siguen leyendo sin migrar datos.
+  """
+
+  def __init__(
+    self,
+    pool: AsyncConnectionPool,
+    table_name: str = "langchain_chat_history",
+    summary_table_name: str = "chat_summaries"
+  ):
+    self.pool = pool
+    self.table_name = table_name
+    # Resumen acumulado de los turnos viejos de cada sesión (ver services/history_compaction.py)
+    self.summary_table_name = summary_table_name
+
+  async def create_schema(self):
+    """Crea la tabla y el índice (session_id, id) una sola vez, en el startup"""
+    table = sql.Identifier(self.table_name)
+    async with self.pool.connection() as connection:
+      await connection.execute(sql.SQL(
+        "CREATE TABLE IF NOT EXISTS {table} ("
+        "id SERIAL PRIMARY KEY, "
+        "session_id UUID NOT NULL, "
+        "message JSONB NOT NULL, "
+        "created_at TIMESTAMPTZ NOT NULL DEFAULT NOW())"
+      ).format(table=table))
+      await connection.execute(sql.SQL(
+        "CREATE INDEX IF NOT EXISTS {index} ON {table} (session_id, id)"
+      ).format(index=sql.Identifier(f"idx_{self.table_name}_session_id_id"), table=table))
+      await connection.execute(sql.SQL(
+        "CREATE TABLE IF NOT EXISTS {table} ("
+        "session_id UUID PRIMARY KEY, "
+        "summary TEXT NOT NULL, "
+        "last_message_id INTEGER NOT NULL, "
+        "updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW())"
+      ).format(table=sql.Identifier(self.summary_table_name)))
+
+  async def get_recent_messages(self, session_id: str, limit: int = 6) -> Tuple[Optional[str], List[BaseMessage]]:
+    """
+    Retorna el resumen de la sesión (si existe) y los últimos `limit` mensajes que
+    todavía no se incorporaron a él, en orden cronológico.
+    """
+    summary_query = sql.SQL(
+      "SELECT summary, last_message_id FROM {table} WHERE session_id = %s"
+    ).format(table=sql.Identifier(self.summary_table_name))
+    messages_query = sql.SQL(
+      "SELECT message FROM ("
+      "SELECT id, message FROM {table} WHERE session_id = %s AND id > %s ORDER BY id DESC LIMIT %s"
+      ") AS recent ORDER BY id"
+    ).format(table=sql.Identifier(self.table_name))
+
+    async with self.pool.connection() as connection:
+      cursor = await connection.execute(summary_query, (session_id,))
+      summary_row = await cursor.fetchone()
+      summary, last_message_id = summary_row if summary_row else (None, 0)
+
+      cursor = await connection.execute(messages_query, (session_id, last_message_id, limit))
+      rows = await cursor.fetchall()
+
+    return summary, messages_from_dict([row[0] for row in rows])
+
+  async def get_unsummarized_messages(self, session_id: str) -> Tuple[Optional[str], List[Tuple[int, BaseMessage]]]:
+    """Resumen vigente y todos los mensajes posteriores a él, con su id (para la compactación)"""
+    summary_query = sql.SQL(
+      "SELECT summary, last_message_id FROM {table} WHERE session_id = %s"
+    ).format(table=sql.Identifier(self.summary_table_name))
+    messages_query = sql.SQL(
+      "SELECT id, message FROM {table} WHERE session_id = %s AND id > %s ORDER BY id"
+    ).format(table=sql.Identifier(self.table_name))
+
+    async with self.pool.connection() as connection:
+      cursor = await connection.execute(summary_query, (session_id,))
+      summary_row = await cursor.fetchone()
+      summary, last_message_id = summary_row if summary_row else (None, 0)
+
+      cursor = await connection.execute(messages_query, (session_id, last_message_id))
+      rows = await cursor.fetchall()
+
+    messages = messages_from_dict([row[1] for row in rows])
+    return summary, [(row[0], message) for row, message in zip(rows, messages)]
+
+  async def save_summary(self, session_id: str, summary: str, last_message_id: int):
+    """
+    Guarda el resumen que cubre hasta `last_message_id`. Si otro worker ya guardó
+    un resumen más nuevo, este se descarta.
+    """
+    query = sql.SQL(
+      "INSERT INTO {table} (session_id, summary, last_message_id) VALUES (%s, %s, %s) "
+      "ON CONFLICT (session_id) DO UPDATE SET "
+      "summary = EXCLUDED.summary, last_message_id = EXCLUDED.last_message_id, updated_at = NOW() "
+      "WHERE {table}.last_message_id < EXCLUDED.last_message_id"
+    ).format(table=sql.Identifier(self.summary_table_name))
+
+    async with self.pool.connection() as connection:
+      await connection.execute(query, (session_id, summary, last_message_id))
+
+  async def add_exchange(self, session_id: str, question: str, answer: str):
+    """Guarda la pregunta y la respuesta en un solo INSERT (un round trip)"""
+    await self.add_exchanges([(session_id, question, answer)])
+
+  async def add_exchanges(self, exchanges: List[Tuple[str, str, str]]):
+    """Guarda varios pares (session_id, pregunta, respuesta) en un único INSERT multi-fila"""
+    if not exchanges:
+      return
+
+    values = sql.SQL(", ").join([sql.SQL("(%s, %s), (%s, %s)")] * len(exchanges))
+    query = sql.SQL("INSERT INTO {table} (session_id, message) VALUES {values}").format(
+      table=sql.Identifier(self.table_name),
+      values=values
+    )
+
+    params = []
+    for session_id, question, answer in exchanges:
+      params += [
+        session_id, json.dumps(message_to_dict(HumanMessage(content=question))),
+        session_id, json.dumps(message_to_dict(AIMessage(content=answer)))
+      ]
+
+    async with self.pool.connection() as connection:
+      await connection.execute(query, params)
+
+
+# Instancia global para usar en los routers
+chat_history_store = ChatHistoryStore(pg_pool)
@@ -0,0 +1,92 @@
+import hashlib
+import os
+from datetime import datetime
+from typing import Dict, List
+
+from dotenv import load_dotenv
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from database import async_engine
+from models.chunk_embedding import ChunkEmbedding
+from services.batch_embedder import BatchEmbedder, batch_embedder
+from services.metrics import CHUNK_EMBEDDING_CACHE
+
+load_dotenv()
+
+
+def content_hash(text: str, task_type: str) -> str:
+  """El task_type entra en la clave: el mismo texto da vectores distintos según la tarea"""
+  return hashlib.sha256(f"{task_type}:{text}".encode("utf-8")).hexdigest()
+
+
+class ChunkEmbeddingCache:
+  """
+  Caché de vectores de chunks por contenido (sha256 del task_type y el texto) delante de BatchEmbedder.
+  Al reprocesar un documento o subir una versión casi igual solo se vectoriza el texto
+  que cambió; los chunks repetidos dentro de un mismo grupo se vectorizan una vez.
+  """
+
+  def __init__(self, embedder: BatchEmbedder, enabled: bool = True):
+    self.embedder = embedder
+    self.enabled = enabled
+
+  async def embed(self, texts: List[str]) -> List[List[float]]:
+    """Retorna los vectores en el mismo orden que `texts`"""
+    if not self.enabled:
+      return await self.embedder.embed(texts)
+
+    hashes = [content_hash(text, self.embedder.task_type) for text in texts]
+    vectors: Dict[str, List[float]] = await self._get_many(list(set(hashes)))
+
+    missing: Dict[str, str] = {}
+    for key, text in zip(hashes, texts):
+      if key not in vectors:
+        missing.setdefault(key, text)
+
+    CHUNK_EMBEDDING_CACHE.labels("hit").inc(len(texts) - len(missing))
+    CHUNK_EMBEDDING_CACHE.labels("miss").inc(len(missing))
+
+    if missing:
+      new_vectors = await self.embedder.embed(list(missing.values()))
+      new_entries = dict(zip(missing.keys(), new_vectors))
+      await self._set_many(new_entries)
+      vectors.update(new_entries)
+
+    return [vectors[key] for key in hashes]
+
+  async def _get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+    try:
+      async with AsyncSession(async_engine) as session:
+        rows = (await session.exec(
+          select(ChunkEmbedding.content_hash, ChunkEmbedding.embedding)
+          .where(ChunkEmbedding.content_hash.in_(keys))
+        )).all()
+    except Exception as e:
+      # La caché nunca debe tumbar la ingesta: ante un fallo se vectoriza todo
+      print(f"Error leyendo caché de embeddings de chunks: {str(e)}")
+      return {}
+
+    return {key: [float(x) for x in embedding] for key, embedding in rows}
+
+  async def _set_many(self, entries: Dict[str, List[float]]):
+    now = datetime.now()
+    statement = insert(ChunkEmbedding).values([
+      {"content_hash": key, "embedding": vector, "created_at": now}
+      for key, vector in entries.items()
+    ]).on_conflict_do_nothing(index_elements=["content_hash"])
+
+    try:
+      async with AsyncSession(async_engine) as session:
+        await session.exec(statement)
+        await session.commit()
+    except Exception as e:
+      print(f"Error guardando caché de embeddings de chunks: {str(e)}")
+
+
+# Instancia global para la ingesta de documentos
+chunk_embedding_cache = ChunkEmbeddingCache(
+  batch_embedder,
+  enabled=os.getenv("CHUNK_EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+)
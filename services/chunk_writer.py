@@ -0,0 +1,113 @@
+import os
+import weakref
+from typing import Iterable, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+import numpy as np
+from dotenv import load_dotenv
+from pgvector.psycopg import register_vector_async
+from psycopg_pool import AsyncConnectionPool
+
+from database import pg_pool
+
+load_dotenv()
+
+# (contenido, página, vector)
+ChunkRow = Tuple[str, Optional[int], List[float]]
+
+
+class DocumentDeletedError(Exception):
+  """El documento (o su servicio) se eliminó mientras se estaba procesando"""
+
+
+class ChunkWriter:
+  """
+  Escritura masiva de document_chunks con COPY binario sobre el pool de psycopg.
+  Cada lote de `batch_size` filas va en su propia transacción, así la memoria no crece
+  con el tamaño del documento y no se arma un objeto ORM por chunk.
+  """
+
+  COPY_SQL = (
+    "COPY document_chunks (id, document_id, service_id, content, page_number, embedding) "
+    "FROM STDIN WITH (FORMAT BINARY)"
+  )
+  COPY_TYPES = ["uuid", "uuid", "int4", "text", "int4", "vector"]
+
+  def __init__(self, pool: AsyncConnectionPool, batch_size: int = 500):
+    self.pool = pool
+    self.batch_size = batch_size
+    # Conexiones del pool que ya tienen registrado el tipo vector de pgvector
+    self._registered = weakref.WeakSet()
+
+  async def write(
+    self,
+    document_id: UUID,
+    service_id: int,
+    rows: Iterable[ChunkRow],
+    processed_pages: Optional[int] = None
+  ) -> int:
+    """
+    Escribe los chunks del documento y retorna cuántas filas se insertaron.
+    Con `processed_pages`, el checkpoint del documento se actualiza en la misma
+    transacción que el último lote: si se guardó, sus chunks también.
+    Lanza DocumentDeletedError si el documento se eliminó: no se escriben más chunks.
+    """
+    written = 0
+    batch: List[ChunkRow] = []
+
+    for row in rows:
+      batch.append(row)
+      if len(batch) >= self.batch_size:
+        written += await self._copy(document_id, service_id, batch)
+        batch = []
+
+    if batch or processed_pages is not None:
+      written += await self._copy(document_id, service_id, batch, processed_pages)
+
+    return written
+
+  async def _copy(
+    self,
+    document_id: UUID,
+    service_id: int,
+    batch: List[ChunkRow],
+    processed_pages: Optional[int] = None
+  ) -> int:
+    # Al salir del bloque el pool hace commit: un lote = una transacción
+    async with self.pool.connection() as connection:
+      if connection not in self._registered:
+        await register_vector_async(connection)
+        self._registered.add(connection)
+
+      async with connection.cursor() as cursor:
+        # FOR SHARE: un borrado en curso espera a este lote (y su UPDATE de chunks lo ve);
+        # si el borrado ya se confirmó, el lote no se escribe
+        await cursor.execute("SELECT deleted_at FROM documents WHERE id = %s FOR SHARE", (document_id,))
+        document = await cursor.fetchone()
+        if document is None or document[0] is not None:
+          raise DocumentDeletedError(f"El documento {document_id} fue eliminado")
+
+        if batch:
+          async with cursor.copy(self.COPY_SQL) as copy:
+            copy.set_types(self.COPY_TYPES)
+            for content, page_number, embedding in batch:
+              await copy.write_row((
+                uuid4(),
+                document_id,
+                service_id,
+                content,
+                page_number,
+                np.asarray(embedding, dtype=np.float32)
+              ))
+
+        if processed_pages is not None:
+          await cursor.execute(
+            "UPDATE documents SET processed_pages = %s WHERE id = %s",
+            (processed_pages, document_id)
+          )
+
+    return len(batch)
+
+
+# Instancia global para la ingesta de documentos
+chunk_writer = ChunkWriter(pg_pool, batch_size=int(os.getenv("CHUNK_WRITE_BATCH_SIZE", "500")))
@@ -0,0 +1,22 @@
+import os
+
+from dotenv import load_dotenv
+from langchain_core.documents import Document as LangchainDocument
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+load_dotenv()
+
+# Sin clientes ni conexiones: lo importan la ingesta y scripts/eval_retrieval.py (offline)
+
+# Tamaño y solapamiento de los chunks (se pueden ajustar con scripts/eval_retrieval.py)
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+
+
+def build_text_splitter(chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> RecursiveCharacterTextSplitter:
+  return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+
+
+def page_document(path: str, page_index: int, text: str) -> LangchainDocument:
+  """Página extraída por services.pdf_extraction, con la metadata que usan los chunks"""
+  return LangchainDocument(page_content=text, metadata={"source": path, "page": page_index})
@@ -0,0 +1,138 @@
+import os
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Candidatos que se traen de la búsqueda antes de diversificar (sobre-muestreo)
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "20"))
+# Fragmentos máximos que entran al prompt
+CONTEXT_MAX_PASSAGES = int(os.getenv("CONTEXT_MAX_PASSAGES", "5"))
+# Presupuesto aproximado de tokens para el CONTEXTO del prompt de sistema
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# 1.0 = solo relevancia, 0.0 = solo diversidad
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+
+# Aproximación de tokens para texto en español sin llamar a la API de Gemini
+CHARS_PER_TOKEN = 4
+# Rango de solapamiento buscado entre chunks vecinos (el splitter usa chunk_overlap=200)
+MIN_OVERLAP = 20
+MAX_OVERLAP = 400
+
+
+class ContextPassage(NamedTuple):
+  id: str
+  content: str
+  page_number: Optional[int]
+  # Todos los chunks que quedaron fusionados en este pasaje (para QueryLog)
+  chunk_ids: List[str]
+
+
+def estimate_tokens(text: str) -> int:
+  return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def mmr_select(candidates: list, query_vector: List[float], k: int, lambda_mult: float = MMR_LAMBDA) -> list:
+  """Maximal Marginal Relevance: relevantes para la pregunta pero poco parecidos entre sí"""
+  if len(candidates) <= 1 or any(c.embedding is None for c in candidates):
+    return list(candidates[:k])
+
+  matrix = np.asarray([c.embedding for c in candidates], dtype=np.float32)
+  matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+  query = np.asarray(query_vector, dtype=np.float32)
+  query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+  relevance = matrix @ query
+  similarity = matrix @ matrix.T
+
+  selected = [int(np.argmax(relevance))]
+  remaining = [i for i in range(len(candidates)) if i != selected[0]]
+
+  while remaining and len(selected) < k:
+    redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+    scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * redundancy
+    best = remaining[int(np.argmax(scores))]
+    selected.append(best)
+    remaining.remove(best)
+
+  return [candidates[i] for i in selected]
+
+
+def _overlap(left: str, right: str) -> int:
+  """Largo del sufijo de `left` que es prefijo de `right` (0 si no se solapan)"""
+  for size in range(min(len(left), len(right), MAX_OVERLAP), MIN_OVERLAP - 1, -1):
+    if left.endswith(right[:size]):
+      return size
+  return 0
+
+
+def merge_passage(merged: List[ContextPassage], passage: ContextPassage, document_ids: dict):
+  """
+  Agrega `passage` a `merged`, uniéndolo con un chunk vecino del mismo documento y página
+  si su texto se repite por el chunk_overlap del splitter (o si uno contiene al otro).
+  """
+  for i, current in enumerate(merged):
+    same_page = (
+      document_ids.get(current.id) == document_ids.get(passage.id)
+      and current.page_number == passage.page_number
+    )
+    if not same_page:
+      continue
+
+    if passage.content in current.content:
+      merged[i] = current._replace(chunk_ids=current.chunk_ids + passage.chunk_ids)
+      return
+    if current.content in passage.content:
+      merged[i] = passage._replace(id=current.id, chunk_ids=current.chunk_ids + passage.chunk_ids)
+      return
+
+    after = _overlap(current.content, passage.content)
+    before = _overlap(passage.content, current.content)
+    if after or before:
+      if after >= before:
+        content = current.content + passage.content[after:]
+      else:
+        content = passage.content + current.content[before:]
+      merged[i] = current._replace(content=content, chunk_ids=current.chunk_ids + passage.chunk_ids)
+      return
+
+  merged.append(passage)
+
+
+def assemble_context(
+  candidates: list,
+  query_vector: List[float],
+  max_passages: int = CONTEXT_MAX_PASSAGES,
+  token_budget: int = CONTEXT_TOKEN_BUDGET
+) -> List[ContextPassage]:
+  """
+  Etapa entre la búsqueda y el SystemMessage: diversifica con MMR, fusiona solapamientos
+  y recorta al presupuesto de tokens. Recibe filas con id, document_id, content,
+  page_number y embedding (sobre-muestreadas) y retorna los pasajes para el prompt.
+  """
+  # Orden MMR completo: si dos candidatos se fusionan, el siguiente de la lista ocupa su lugar
+  ranked = mmr_select(candidates, query_vector, len(candidates))
+  document_ids = {str(c.id): str(getattr(c, "document_id", None)) for c in ranked}
+
+  passages: List[ContextPassage] = []
+  for candidate in ranked:
+    if len(passages) >= max_passages:
+      break
+    merge_passage(passages, ContextPassage(str(candidate.id), candidate.content, candidate.page_number, [str(candidate.id)]), document_ids)
+
+  context = []
+  used_tokens = 0
+  for passage in passages:
+    tokens = estimate_tokens(passage.content)
+    if used_tokens + tokens > token_budget:
+      if not context:
+        # El pasaje más relevante siempre entra, recortado al presupuesto
+        context.append(passage._replace(content=passage.content[:token_budget * CHARS_PER_TOKEN]))
+        used_tokens = token_budget
+      continue
+    context.append(passage)
+    used_tokens += tokens
+
+  return context
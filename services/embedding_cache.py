@@ -0,0 +1,271 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from database import async_engine
+from models.query_embedding import QueryEmbedding
+
+load_dotenv()
+
+
+def normalize_question(question: str) -> str:
+  """Normaliza la pregunta para que variantes triviales compartan la misma llave"""
+  text = re.sub(r"\s+", " ", question.strip().lower())
+  return text.strip(" ¿?¡!.,;:")
+
+
+class QueryEmbeddingCache:
+  """
+  Caché LRU (con TTL opcional) de vectores de preguntas delante del embedder de Gemini.
+  El backend compartido ('postgres' o 'file') permite que varios workers reutilicen los vectores.
+  Como mucho cada `prune_interval` segundos, al escribir, se borran del backend compartido las
+  entradas vencidas y las más viejas por encima de `shared_max_size`.
+  """
+
+  def __init__(
+    self,
+    embeddings: GoogleGenerativeAIEmbeddings,
+    max_size: int = 1000,
+    ttl_seconds: float = 0,
+    backend: str = "memory",
+    file_path: Optional[str] = None,
+    shared_max_size: int = 100000,
+    prune_interval: float = 300
+  ):
+    if backend not in ("memory", "postgres", "file"):
+      raise ValueError(f"Backend de caché de embeddings no soportado: {backend}")
+
+    self.embeddings = embeddings
+    self.max_size = max_size
+    self.ttl_seconds = ttl_seconds
+    self.backend = backend
+    self.file_path = file_path or "query_embeddings_cache.sqlite3"
+    self.shared_max_size = shared_max_size
+    self.prune_interval = prune_interval
+    self._last_prune = 0.0
+
+    self._entries: "OrderedDict[str, tuple[float, List[float]]]" = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+    if self.backend == "file":
+      self._init_file()
+
+  async def embed_query(self, question: str) -> List[float]:
+    """Retorna el vector de la pregunta, llamando a Gemini solo si no está en caché"""
+    key = normalize_question(question)
+
+    vector = self._get_local(key)
+    if vector is None and self.backend != "memory":
+      vector = await self._get_shared(key)
+      if vector is not None:
+        self._set_local(key, vector)
+
+    if vector is not None:
+      self.hits += 1
+      return vector
+
+    self.misses += 1
+    vector = await self.embeddings.aembed_query(question)
+    self._set_local(key, vector)
+    if self.backend != "memory":
+      await self._set_shared(key, vector)
+    return vector
+
+  async def embed_queries(self, questions: List[str]) -> List[List[float]]:
+    """Versión por lotes: las preguntas que no están en caché se vectorizan en una sola llamada"""
+    vectors: List[Optional[List[float]]] = []
+    for question in questions:
+      key = normalize_question(question)
+      vector = self._get_local(key)
+      if vector is None and self.backend != "memory":
+        vector = await self._get_shared(key)
+        if vector is not None:
+          self._set_local(key, vector)
+      vectors.append(vector)
+
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    self.hits += len(questions) - len(missing)
+    self.misses += len(missing)
+
+    if missing:
+      new_vectors = await self.embeddings.aembed_documents(
+        [questions[i] for i in missing],
+        task_type="RETRIEVAL_QUERY"
+      )
+      for i, vector in zip(missing, new_vectors):
+        key = normalize_question(questions[i])
+        vectors[i] = vector
+        self._set_local(key, vector)
+        if self.backend != "memory":
+          await self._set_shared(key, vector)
+
+    return vectors
+
+  def stats(self) -> dict:
+    total = self.hits + self.misses
+    return {
+      "backend": self.backend,
+      "size": len(self._entries),
+      "max_size": self.max_size,
+      "hits": self.hits,
+      "misses": self.misses,
+      "hit_rate": round(self.hits / total, 4) if total else 0.0
+    }
+
+  # --- Caché en memoria (LRU + TTL) ---
+
+  def _is_expired(self, stored_at: float) -> bool:
+    return self.ttl_seconds > 0 and time.time() - stored_at > self.ttl_seconds
+
+  def _get_local(self, key: str) -> Optional[List[float]]:
+    entry = self._entries.get(key)
+    if entry is None:
+      return None
+
+    stored_at, vector = entry
+    if self._is_expired(stored_at):
+      del self._entries[key]
+      return None
+
+    self._entries.move_to_end(key)
+    return vector
+
+  def _set_local(self, key: str, vector: List[float]):
+    self._entries[key] = (time.time(), vector)
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.max_size:
+      self._entries.popitem(last=False)
+
+  # --- Backend compartido ---
+
+  async def _get_shared(self, key: str) -> Optional[List[float]]:
+    try:
+      if self.backend == "file":
+        return await asyncio.to_thread(self._get_file, key)
+      return await self._get_postgres(key)
+    except Exception as e:
+      # La caché compartida nunca debe tumbar el chat: ante un fallo vamos a Gemini
+      print(f"Error leyendo caché de embeddings ({self.backend}): {str(e)}")
+      return None
+
+  async def _set_shared(self, key: str, vector: List[float]):
+    try:
+      if self.backend == "file":
+        await asyncio.to_thread(self._set_file, key, vector)
+      else:
+        await self._set_postgres(key, vector)
+    except Exception as e:
+      print(f"Error guardando caché de embeddings ({self.backend}): {str(e)}")
+
+    if time.time() - self._last_prune >= self.prune_interval:
+      self._last_prune = time.time()
+      try:
+        if self.backend == "file":
+          await asyncio.to_thread(self._prune_file)
+        else:
+          await self._prune_postgres()
+      except Exception as e:
+        print(f"Error limpiando caché de embeddings ({self.backend}): {str(e)}")
+
+  async def _get_postgres(self, key: str) -> Optional[List[float]]:
+    statement = select(QueryEmbedding.embedding).where(QueryEmbedding.question == key)
+    if self.ttl_seconds > 0:
+      statement = statement.where(QueryEmbedding.created_at > datetime.now() - timedelta(seconds=self.ttl_seconds))
+
+    async with AsyncSession(async_engine) as session:
+      embedding = (await session.exec(statement)).first()
+
+    return [float(x) for x in embedding] if embedding is not None else None
+
+  async def _set_postgres(self, key: str, vector: List[float]):
+    statement = insert(QueryEmbedding).values(
+      question=key,
+      embedding=vector,
+      created_at=datetime.now()
+    ).on_conflict_do_update(
+      index_elements=["question"],
+      set_={"embedding": vector, "created_at": datetime.now()}
+    )
+
+    async with AsyncSession(async_engine) as session:
+      await session.exec(statement)
+      await session.commit()
+
+  async def _prune_postgres(self):
+    newest = (
+      select(QueryEmbedding.question)
+      .order_by(QueryEmbedding.created_at.desc())
+      .offset(self.shared_max_size)
+    )
+
+    async with AsyncSession(async_engine) as session:
+      if self.ttl_seconds > 0:
+        await session.exec(
+          delete(QueryEmbedding)
+          .where(QueryEmbedding.created_at <= datetime.now() - timedelta(seconds=self.ttl_seconds))
+        )
+      await session.exec(delete(QueryEmbedding).where(QueryEmbedding.question.in_(newest)))
+      await session.commit()
+
+  def _init_file(self):
+    with sqlite3.connect(self.file_path) as connection:
+      connection.execute(
+        "CREATE TABLE IF NOT EXISTS query_embeddings (question TEXT PRIMARY KEY, embedding TEXT, created_at REAL)"
+      )
+      connection.execute(
+        "CREATE INDEX IF NOT EXISTS ix_query_embeddings_created_at ON query_embeddings (created_at)"
+      )
+
+  def _prune_file(self):
+    with sqlite3.connect(self.file_path, timeout=5) as connection:
+      if self.ttl_seconds > 0:
+        connection.execute(
+          "DELETE FROM query_embeddings WHERE created_at <= ?", (time.time() - self.ttl_seconds,)
+        )
+      connection.execute(
+        "DELETE FROM query_embeddings WHERE question IN "
+        "(SELECT question FROM query_embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+        (self.shared_max_size,)
+      )
+
+  def _get_file(self, key: str) -> Optional[List[float]]:
+    with sqlite3.connect(self.file_path, timeout=5) as connection:
+      row = connection.execute(
+        "SELECT embedding, created_at FROM query_embeddings WHERE question = ?", (key,)
+      ).fetchone()
+
+    if row is None or self._is_expired(row[1]):
+      return None
+    return json.loads(row[0])
+
+  def _set_file(self, key: str, vector: List[float]):
+    with sqlite3.connect(self.file_path, timeout=5) as connection:
+      connection.execute(
+        "INSERT OR REPLACE INTO query_embeddings (question, embedding, created_at) VALUES (?, ?, ?)",
+        (key, json.dumps(vector), time.time())
+      )
+
+
+# Instancia global para usar en los routers
+query_embedding_cache = QueryEmbeddingCache(
+  GoogleGenerativeAIEmbeddings(model="gemini-embedding-001", output_dimensionality=768),
+  max_size=int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1000")),
+  ttl_seconds=float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "86400")),
+  backend=os.getenv("QUERY_EMBEDDING_CACHE_BACKEND", "memory"),
+  file_path=os.getenv("QUERY_EMBEDDING_CACHE_FILE"),
+  shared_max_size=int(os.getenv("QUERY_EMBEDDING_CACHE_SHARED_SIZE", "100000")),
+  prune_interval=float(os.getenv("QUERY_EMBEDDING_CACHE_PRUNE_INTERVAL", "300"))
+)
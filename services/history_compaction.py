@@ -0,0 +1,90 @@
+import asyncio
+import os
+from typing import Optional
+
+from dotenv import load_dotenv
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from services.chat_history import ChatHistoryStore, chat_history_store
+from services.context import estimate_tokens
+
+load_dotenv()
+
+
+class HistoryCompactor:
+  """
+  Compacta el historial de las sesiones largas: cuando los mensajes que aún no están
+  resumidos superan `threshold_tokens`, los más viejos se incorporan al resumen de la
+  sesión y solo quedan sueltos los últimos `keep_recent`. Corre fuera del request:
+  `schedule` lanza la tarea y retorna enseguida.
+  """
+
+  def __init__(self, store: ChatHistoryStore, llm: ChatGoogleGenerativeAI, threshold_tokens: int = 2000, keep_recent: int = 4):
+    self.store = store
+    self.llm = llm
+    self.threshold_tokens = threshold_tokens
+    self.keep_recent = keep_recent
+    # Una compactación a la vez por sesión dentro del proceso
+    self._tasks: dict = {}
+
+  def schedule(self, session_id: str):
+    if self.threshold_tokens <= 0 or session_id in self._tasks:
+      return
+
+    task = asyncio.create_task(self._run(session_id))
+    self._tasks[session_id] = task
+    task.add_done_callback(lambda _: self._tasks.pop(session_id, None))
+
+  async def close(self, timeout: float = 10):
+    """Espera las compactaciones en curso en el shutdown (las que no alcancen se cancelan)"""
+    if not self._tasks:
+      return
+    _, pending = await asyncio.wait(list(self._tasks.values()), timeout=timeout)
+    for task in pending:
+      task.cancel()
+
+  async def _run(self, session_id: str):
+    try:
+      await self.compact(session_id)
+    except Exception as e:
+      # Si falla, el prompt sigue usando la ventana de mensajes recientes sin resumen
+      print(f"Error compactando historial de la sesión {session_id}: {str(e)}")
+
+  async def compact(self, session_id: str) -> Optional[str]:
+    summary, messages = await self.store.get_unsummarized_messages(session_id)
+
+    tokens = sum(estimate_tokens(str(message.content)) for _, message in messages)
+    if tokens <= self.threshold_tokens or len(messages) <= self.keep_recent:
+      return None
+
+    to_fold = messages[:len(messages) - self.keep_recent]
+    transcript = "\n".join(
+      f"{'Usuario' if isinstance(message, HumanMessage) else 'Asistente'}: {message.content}"
+      for _, message in to_fold
+    )
+
+    response = await self.llm.ainvoke([
+      SystemMessage(content=(
+        "Resume la conversación entre un usuario y un asistente técnico de soporte interno. "
+        "Conserva los datos concretos (códigos de error, transacciones, pasos ya indicados, decisiones) "
+        "y omite saludos y repeticiones. Responde solo con el resumen, en español y en pocas líneas."
+      )),
+      HumanMessage(content=(
+        f"RESUMEN ANTERIOR:\n{summary or '(sin resumen)'}\n\n"
+        f"NUEVOS MENSAJES:\n{transcript}"
+      ))
+    ])
+
+    new_summary = str(response.content).strip()
+    await self.store.save_summary(session_id, new_summary, to_fold[-1][0])
+    return new_summary
+
+
+# Instancia global para usar en los routers
+history_compactor = HistoryCompactor(
+  chat_history_store,
+  ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite", temperature=0.0),
+  threshold_tokens=int(os.getenv("HISTORY_SUMMARY_THRESHOLD_TOKENS", "2000")),
+  keep_recent=int(os.getenv("HISTORY_KEEP_RECENT", "4"))
+)
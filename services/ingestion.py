@@ -0,0 +1,339 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from uuid import UUID
+
+from dotenv import load_dotenv
+from sqlalchemy import func, insert, literal
+from sqlmodel import Session, select, delete
+
+from database import engine
+from models.chunk import DocumentChunk
+from models.document import Document, DocumentStatus
+from services.answer_cache import invalidate_answer_cache
+from services.batch_embedder import batch_embedder
+from services.chunk_embedding_cache import chunk_embedding_cache
+from services.chunking import build_text_splitter, page_document
+from services.chunk_writer import DocumentDeletedError, chunk_writer
+from services.ingestion_progress import ProgressTracker
+from services.metrics import INGESTION_DOCUMENTS, INGESTION_PAGES, INGESTION_CHUNKS, INGESTION_SECONDS
+from services.pdf_extraction import count_pages, extract_page_range
+from services.retrieval import ensure_service_vector_index
+from services.s3_service import s3_client
+from services.soft_delete import soft_delete_document
+
+load_dotenv()
+
+# Capacidad de las colas entre etapas del pipeline (páginas leídas / grupos vectorizados)
+INGESTION_PAGE_QUEUE_SIZE = int(os.getenv("INGESTION_PAGE_QUEUE_SIZE", "16"))
+INGESTION_GROUP_QUEUE_SIZE = int(os.getenv("INGESTION_GROUP_QUEUE_SIZE", "2"))
+# Procesos para extraer texto de los PDF (0 = en un hilo del worker) y páginas por tarea
+INGESTION_EXTRACT_WORKERS = int(os.getenv("INGESTION_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+INGESTION_EXTRACT_PAGES_PER_TASK = int(os.getenv("INGESTION_EXTRACT_PAGES_PER_TASK", "16"))
+
+_extract_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_extract_pool() -> Optional[ProcessPoolExecutor]:
+  """Pool de procesos compartido por todos los documentos del worker (None = hilos)"""
+  global _extract_pool
+  if _extract_pool is None and INGESTION_EXTRACT_WORKERS > 0:
+    # spawn: los procesos no heredan el event loop, los pools de conexiones ni los hilos del worker.
+    # Cada proceso re-importa worker.py, que por eso no importa nada pesado a nivel de módulo
+    _extract_pool = ProcessPoolExecutor(
+      max_workers=INGESTION_EXTRACT_WORKERS,
+      mp_context=multiprocessing.get_context("spawn")
+    )
+  return _extract_pool
+
+
+def shutdown_extract_pool():
+  global _extract_pool
+  if _extract_pool is not None:
+    _extract_pool.shutdown(cancel_futures=True)
+    _extract_pool = None
+
+
+async def extract_pages(path: str, start_page: int, pages: asyncio.Queue, progress: ProgressTracker):
+  """
+  Etapa 1: extrae el texto por rangos de páginas en paralelo en el pool de procesos
+  (pypdf es CPU puro y retiene el GIL) y entrega las páginas en orden, desde start_page.
+  Se mantienen como máximo dos rangos en vuelo por proceso.
+  """
+  loop = asyncio.get_running_loop()
+  executor = get_extract_pool()
+  total_pages = await asyncio.to_thread(count_pages, path)
+  progress.pages_total = total_pages
+  ranges = iter([
+    (start, min(start + INGESTION_EXTRACT_PAGES_PER_TASK, total_pages))
+    for start in range(start_page, total_pages, INGESTION_EXTRACT_PAGES_PER_TASK)
+  ])
+  pending = deque()
+
+  def submit_next():
+    page_range = next(ranges, None)
+    if page_range is not None:
+      pending.append(loop.run_in_executor(executor, extract_page_range, path, *page_range))
+
+  try:
+    for _ in range(max(INGESTION_EXTRACT_WORKERS, 1) * 2):
+      submit_next()
+
+    while pending:
+      with progress.stage("extract"):
+        extracted = await pending.popleft()
+      submit_next()
+      progress.add(pages_parsed=len(extracted))
+      for page_index, text in extracted:
+        await pages.put((page_index, page_document(path, page_index, text)))
+  finally:
+    for future in pending:
+      future.cancel()
+
+  await pages.put(None)
+
+
+async def embed_pages(pages: asyncio.Queue, groups: asyncio.Queue, progress: ProgressTracker):
+  """
+  Etapa 2: divide cada página en chunks y los vectoriza por grupos de páginas completas,
+  del tamaño que aprovecha todos los lotes concurrentes de batch_embedder. Los chunks cuyo
+  texto ya se vectorizó antes (en este u otro documento) salen de la caché sin llamar a Gemini.
+  """
+  text_splitter = build_text_splitter()
+  group_size = batch_embedder.batch_size * batch_embedder.concurrency
+  group_chunks = []
+  last_page = None
+
+  async def flush():
+    with progress.stage("embed"):
+      vectors = await chunk_embedding_cache.embed([content for content, _ in group_chunks])
+    progress.add(chunks_embedded=len(vectors))
+    rows = [(content, page_number, vector) for (content, page_number), vector in zip(group_chunks, vectors)]
+    # processed_pages es la cantidad de páginas guardadas, es decir, la siguiente por leer
+    await groups.put((last_page + 1, rows))
+
+  while True:
+    item = await pages.get()
+    if item is None:
+      break
+
+    page_index, page = item
+    INGESTION_PAGES.inc()
+    with progress.stage("split"):
+      page_chunks = [
+        (chunk.page_content, chunk.metadata.get("page", page_index))
+        for chunk in text_splitter.split_documents([page])
+      ]
+    progress.add(chunks_produced=len(page_chunks))
+    group_chunks += page_chunks
+    last_page = page_index
+
+    if len(group_chunks) >= group_size:
+      await flush()
+      group_chunks = []
+      last_page = None
+
+  if last_page is not None:
+    await flush()
+  await groups.put(None)
+
+
+async def write_groups(document_id: UUID, service_id: int, groups: asyncio.Queue, progress: ProgressTracker) -> int:
+  """Etapa 3: COPY de cada grupo junto con el checkpoint de páginas del documento"""
+  written = 0
+  while True:
+    item = await groups.get()
+    if item is None:
+      return written
+
+    processed_pages, rows = item
+    with progress.stage("write"):
+      count = await chunk_writer.write(document_id, service_id, rows, processed_pages=processed_pages)
+    INGESTION_CHUNKS.inc(count)
+    progress.add(rows_written=count)
+    written += count
+
+
+async def run_pipeline(
+  path: str,
+  document_id: UUID,
+  service_id: int,
+  start_page: int,
+  progress: ProgressTracker
+) -> int:
+  """
+  extraer -> dividir y vectorizar -> escribir, conectadas por colas acotadas: la memoria depende
+  del tamaño de las colas y no del documento. Si una etapa falla se cancelan las demás.
+  """
+  pages = asyncio.Queue(maxsize=INGESTION_PAGE_QUEUE_SIZE)
+  groups = asyncio.Queue(maxsize=INGESTION_GROUP_QUEUE_SIZE)
+  tasks = [
+    asyncio.create_task(extract_pages(path, start_page, pages, progress)),
+    asyncio.create_task(embed_pages(pages, groups, progress)),
+    asyncio.create_task(write_groups(document_id, service_id, groups, progress))
+  ]
+
+  try:
+    await asyncio.gather(*tasks)
+  except BaseException:
+    for task in tasks:
+      task.cancel()
+    raise
+
+  return tasks[2].result()
+
+
+def find_duplicate_source(session: Session, document: Document):
+  """Documento READY con el mismo PDF (mismo hash_md5), en cualquier servicio"""
+  if not document.hash_md5:
+    return None
+
+  return session.exec(
+    select(Document)
+    .where(Document.hash_md5 == document.hash_md5)
+    .where(Document.id != document.id)
+    .where(Document.status == DocumentStatus.READY)
+    .where(Document.deleted_at == None)
+    .order_by(Document.upload_date.desc())
+    .limit(1)
+  ).first()
+
+
+def copy_chunks(session: Session, source: Document, document_id: UUID, service_id: int) -> int:
+  """
+  Copia los chunks (texto y vector) de otro documento con el mismo PDF en un solo
+  INSERT ... SELECT dentro de Postgres: no se descarga, parsea ni vectoriza nada.
+  """
+  columns = ["id", "document_id", "service_id", "content", "page_number", "embedding"]
+  source_chunks = select(
+    func.gen_random_uuid(),
+    literal(document_id),
+    literal(service_id),
+    DocumentChunk.content,
+    DocumentChunk.page_number,
+    DocumentChunk.embedding
+  ).where(DocumentChunk.document_id == source.id, DocumentChunk.deleted_at == None)
+
+  result = session.exec(insert(DocumentChunk).from_select(columns, source_chunks))
+  return result.rowcount
+
+
+def start_document(document_id: UUID, progress: ProgressTracker):
+  """
+  Deja el documento en PROCESSING y descarta lo que quedó después del checkpoint.
+  Si hay un documento READY con el mismo PDF copia sus chunks. Retorna
+  (service_id, s3_key, start_page, chunks copiados o None), o None si el documento ya no existe.
+  """
+  with Session(engine) as session:
+    db_doc = session.get(Document, document_id)
+    if not db_doc or db_doc.deleted_at is not None:
+      return None
+
+    db_doc.status = DocumentStatus.PROCESSING
+    session.add(db_doc)
+    start_page = db_doc.processed_pages
+    # Chunks posteriores al checkpoint: grupo que quedó a medias en un intento anterior
+    session.exec(
+      delete(DocumentChunk)
+      .where(DocumentChunk.document_id == document_id)
+      .where(DocumentChunk.page_number >= start_page)
+    )
+    service_id = db_doc.service_id
+    s3_key = db_doc.s3_key
+
+    # Mismo PDF ya procesado (re-subida o el mismo manual en otro servicio): se copian sus chunks
+    source = find_duplicate_source(session, db_doc) if start_page == 0 else None
+    copied = None
+    if source:
+      copied = copy_chunks(session, source, document_id, service_id)
+      db_doc.processed_pages = source.processed_pages
+      session.add(db_doc)
+      progress.pages_total = source.processed_pages
+      progress.add(rows_written=copied)
+      print(f"Documento {document_id}: chunks copiados del documento {source.id} (mismo hash)")
+    session.commit()
+
+  return service_id, s3_key, start_page, copied
+
+
+def finish_document(document_id: UUID, service_id: int):
+  """
+  Marca el documento READY y cambia la versión de conocimiento del servicio (caché de
+  respuestas e índices en memoria de los procesos web). La fila se bloquea:
+  un borrado concurrente espera a este commit (y marca los chunks) o ya se confirmó y se
+  lanza DocumentDeletedError en vez de dejar READY un documento eliminado.
+  """
+  with Session(engine) as session:
+    db_doc = session.exec(select(Document).where(Document.id == document_id).with_for_update()).first()
+    if db_doc is None or db_doc.deleted_at is not None:
+      raise DocumentDeletedError(f"El documento {document_id} fue eliminado")
+
+    db_doc.status = DocumentStatus.READY
+    session.add(db_doc)
+    invalidate_answer_cache(session, service_id)
+    session.commit()
+
+
+def discard_deleted_document(document_id: UUID):
+  """Marca como eliminados los chunks que se alcanzaron a escribir después del borrado"""
+  with Session(engine) as session:
+    soft_delete_document(session, document_id)
+    session.commit()
+
+
+async def process_document(document_id: UUID):
+  """
+  Descarga el PDF de S3, lo procesa con el pipeline por páginas y deja el documento READY.
+  Lo ejecuta worker.py desde la cola de ingesta. Cada grupo de páginas guardado actualiza
+  Document.processed_pages: si falla, el reintento (o el reproceso) sigue desde ahí.
+  Si otro documento READY tiene el mismo hash_md5, sus chunks se copian en vez de reprocesar.
+  El avance de cada etapa se guarda en ingestion_progress mientras corre.
+  Todo el trabajo síncrono (ORM, DDL) corre en hilos: el event loop lo
+  comparten todos los slots del worker y sus heartbeats.
+  """
+  start_time = time.perf_counter()
+  progress = ProgressTracker(document_id)
+  started = await asyncio.to_thread(start_document, document_id, progress)
+  if started is None:
+    return
+  service_id, s3_key, start_page, written = started
+
+  await progress.start()
+
+  try:
+    if written is None:
+      # El PDF va a un archivo temporal (no a memoria); boto3 corre fuera del event loop
+      with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+        tmp_path = tmp_file.name
+      try:
+        await asyncio.to_thread(s3_client.s3.download_file, s3_client.bucket_name, s3_key, tmp_path)
+
+        if start_page:
+          print(f"Documento {document_id}: retomando desde la página {start_page}")
+        written = await run_pipeline(tmp_path, document_id, service_id, start_page, progress)
+      finally:
+        # Borrar el archivo temporal después de leerlo
+        if os.path.exists(tmp_path):
+          os.remove(tmp_path)
+
+    # Índice HNSW parcial del servicio (no hace nada si ya existe)
+    await asyncio.to_thread(ensure_service_vector_index, service_id)
+
+    # Los procesos web ven la nueva versión de conocimiento y reconstruyen su índice en memoria
+    await asyncio.to_thread(finish_document, document_id, service_id)
+  except DocumentDeletedError:
+    # Eliminado (él o su servicio) durante la ingesta: no queda nada buscable y el trabajo termina
+    await asyncio.to_thread(discard_deleted_document, document_id)
+    print(f"Documento {document_id} eliminado durante el procesamiento: se descartan sus chunks")
+    return
+  finally:
+    await progress.finish()
+
+  INGESTION_DOCUMENTS.labels("ready").inc()
+  INGESTION_SECONDS.observe(time.perf_counter() - start_time)
+  print(f"Documento {document_id} procesado con éxito ({written} chunks nuevos).")
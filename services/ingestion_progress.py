@@ -0,0 +1,117 @@
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+
+from dotenv import load_dotenv
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from database import async_engine
+from models.ingestion_progress import IngestionProgress
+from services.metrics import INGESTION_STAGE_SECONDS
+
+load_dotenv()
+
+# Cada cuántos segundos se guardan los contadores mientras el documento se procesa
+INGESTION_PROGRESS_INTERVAL = float(os.getenv("INGESTION_PROGRESS_INTERVAL", "2"))
+
+COUNTERS = ("pages_parsed", "chunks_produced", "chunks_embedded", "rows_written")
+STAGES = ("extract", "split", "embed", "write")
+
+
+class ProgressTracker:
+  """
+  Contadores en memoria de una ejecución de la ingesta. Las etapas del pipeline los
+  incrementan y una tarea los guarda en ingestion_progress cada `flush_interval` segundos,
+  así el pipeline no espera a la base de datos por cada página.
+  """
+
+  def __init__(self, document_id: UUID, flush_interval: float = INGESTION_PROGRESS_INTERVAL):
+    self.document_id = document_id
+    self.flush_interval = flush_interval
+    self.pages_total: Optional[int] = None
+    self.counters = {name: 0 for name in COUNTERS}
+    self.seconds = {stage: 0.0 for stage in STAGES}
+    self.started_at = datetime.now()
+    self._flusher: Optional[asyncio.Task] = None
+
+  def add(self, **counts: int):
+    for name, value in counts.items():
+      self.counters[name] += value
+
+  @contextmanager
+  def stage(self, name: str):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      elapsed = time.perf_counter() - start
+      self.seconds[name] += elapsed
+      INGESTION_STAGE_SECONDS.labels(name).inc(elapsed)
+
+  async def start(self):
+    """Reinicia la fila del documento (cada intento empieza de cero) y arranca el guardado periódico"""
+    await self._save()
+    self._flusher = asyncio.create_task(self._run())
+
+  async def finish(self):
+    if self._flusher:
+      self._flusher.cancel()
+      try:
+        await self._flusher
+      except asyncio.CancelledError:
+        pass
+    await self._save(finished_at=datetime.now())
+
+  async def _run(self):
+    while True:
+      await asyncio.sleep(self.flush_interval)
+      await self._save()
+
+  async def _save(self, finished_at: Optional[datetime] = None):
+    values = {
+      "pages_total": self.pages_total,
+      **self.counters,
+      **{f"{stage}_seconds": round(seconds, 4) for stage, seconds in self.seconds.items()},
+      "started_at": self.started_at,
+      "updated_at": datetime.now(),
+      "finished_at": finished_at
+    }
+    statement = insert(IngestionProgress).values(document_id=self.document_id, **values).on_conflict_do_update(
+      index_elements=["document_id"],
+      set_=values
+    )
+
+    try:
+      async with AsyncSession(async_engine) as session:
+        await session.exec(statement)
+        await session.commit()
+    except Exception as e:
+      # El progreso es informativo: un fallo al guardarlo no debe detener la ingesta
+      print(f"Error guardando el progreso del documento {self.document_id}: {str(e)}")
+
+
+def progress_payload(progress: IngestionProgress, status: str) -> dict:
+  """Contadores de un documento más sus tasas (páginas/s de punta a punta, embeddings/s de la etapa)"""
+  end = progress.finished_at or datetime.now()
+  elapsed = max((end - progress.started_at).total_seconds(), 0.0)
+
+  return {
+    "document_id": str(progress.document_id),
+    "status": status,
+    "pages_total": progress.pages_total,
+    **{name: getattr(progress, name) for name in COUNTERS},
+    "stage_seconds": {stage: getattr(progress, f"{stage}_seconds") for stage in STAGES},
+    "elapsed_seconds": round(elapsed, 2),
+    "pages_per_second": round(progress.pages_parsed / elapsed, 2) if elapsed else 0.0,
+    "embeddings_per_second": (
+      round(progress.chunks_embedded / progress.embed_seconds, 2) if progress.embed_seconds else 0.0
+    ),
+    "started_at": progress.started_at.isoformat(),
+    "updated_at": progress.updated_at.isoformat(),
+    "finished_at": progress.finished_at.isoformat() if progress.finished_at else None
+  }
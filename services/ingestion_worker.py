@@ -0,0 +1,101 @@
+import asyncio
+import os
+import signal
+import socket
+
+from dotenv import load_dotenv
+from prometheus_client import start_http_server
+
+import models  # noqa: F401  (registra todas las tablas en la metadata)
+from database import open_pool, close_pool
+from services.ingestion import process_document, shutdown_extract_pool
+from services.retrieval import ensure_all_service_vector_indexes
+from services.job_queue import (
+  INGESTION_MAX_ATTEMPTS, INGESTION_VISIBILITY_TIMEOUT,
+  claim_job, complete_job, fail_job, heartbeat, recover_stale_documents
+)
+
+load_dotenv()
+
+# Bucle del worker de ingesta (lo arranca worker.py). No vive en worker.py porque los procesos
+# spawn del pool de extracción re-importan el script principal como __mp_main__.
+
+# Documentos que este proceso procesa a la vez
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+# Segundos entre consultas a la cola cuando no hay trabajos
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "2"))
+# Puerto opcional para exponer las métricas de ingesta del worker a Prometheus
+WORKER_METRICS_PORT = os.getenv("WORKER_METRICS_PORT")
+
+
+async def keep_alive(job_id: int, worker_id: str):
+  """Renueva el visibility timeout mientras el documento se sigue procesando"""
+  while True:
+    await asyncio.sleep(INGESTION_VISIBILITY_TIMEOUT / 3)
+    try:
+      await asyncio.to_thread(heartbeat, job_id, worker_id)
+    except Exception as e:
+      print(f"Error renovando el trabajo {job_id}: {str(e)}")
+
+
+async def run_slot(slot: int, stop: asyncio.Event):
+  worker_id = f"{socket.gethostname()}:{os.getpid()}:{slot}"
+
+  while not stop.is_set():
+    try:
+      job = await asyncio.to_thread(claim_job, worker_id)
+    except Exception as e:
+      print(f"Error consultando la cola de ingesta: {str(e)}")
+      job = None
+
+    if job is None:
+      try:
+        await asyncio.wait_for(stop.wait(), WORKER_POLL_INTERVAL)
+      except asyncio.TimeoutError:
+        pass
+      continue
+
+    if job.attempts > INGESTION_MAX_ATTEMPTS:
+      # Retomado tras vencer el visibility timeout demasiadas veces (el worker muere con este PDF)
+      await asyncio.to_thread(fail_job, job, "Se agotaron los intentos: el worker se detuvo durante el procesamiento")
+      continue
+
+    print(f"[{worker_id}] Procesando documento {job.document_id} (intento {job.attempts})")
+    renewer = asyncio.create_task(keep_alive(job.id, worker_id))
+    try:
+      await process_document(job.document_id)
+      if not await asyncio.to_thread(complete_job, job):
+        print(f"[{worker_id}] El trabajo {job.id} ya no es de este worker (lease vencido)")
+    except Exception as e:
+      print(f"Error procesando documento {job.document_id}: {str(e)}")
+      await asyncio.to_thread(fail_job, job, str(e))
+    finally:
+      renewer.cancel()
+
+
+async def main():
+  if WORKER_METRICS_PORT:
+    start_http_server(int(WORKER_METRICS_PORT))
+
+  await open_pool()
+  # Índices HNSW parciales faltantes o inválidos: en segundo plano, la cola no los espera
+  index_builder = asyncio.create_task(asyncio.to_thread(ensure_all_service_vector_indexes))
+  recovered = await asyncio.to_thread(recover_stale_documents)
+  if recovered:
+    print(f"{recovered} documentos pendientes vueltos a encolar")
+
+  # SIGTERM (deploy/reinicio): se termina el documento en curso y no se toman más
+  stop = asyncio.Event()
+  loop = asyncio.get_running_loop()
+  for sig in (signal.SIGTERM, signal.SIGINT):
+    loop.add_signal_handler(sig, stop.set)
+
+  try:
+    await asyncio.gather(*[run_slot(slot, stop) for slot in range(WORKER_CONCURRENCY)])
+  finally:
+    if not index_builder.done():
+      print("Esperando a que terminen las construcciones de índices HNSW en curso")
+    await index_builder
+    shutdown_extract_pool()
+    await close_pool()
+
@@ -0,0 +1,178 @@
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from uuid import UUID
+
+from dotenv import load_dotenv
+from sqlalchemy import and_, exists, or_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, select
+
+from database import engine
+from models.document import Document, DocumentStatus
+from models.ingestion_job import IngestionJob, JobStatus
+from services.metrics import INGESTION_DOCUMENTS
+
+load_dotenv()
+
+# Intentos por documento antes de dejarlo en ERROR
+INGESTION_MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", "3"))
+# Segundos que un worker retiene un trabajo sin renovarlo; vencido, otro worker lo retoma
+INGESTION_VISIBILITY_TIMEOUT = int(os.getenv("INGESTION_VISIBILITY_TIMEOUT", "900"))
+# Espera base entre reintentos (se duplica en cada intento)
+INGESTION_RETRY_BASE_DELAY = int(os.getenv("INGESTION_RETRY_BASE_DELAY", "30"))
+
+
+def enqueue_ingestion(session: Session, document_id: UUID) -> bool:
+  """
+  Encola el procesamiento del documento; el commit lo hace quien llama (misma transacción).
+  El índice único parcial (un solo trabajo QUEUED/RUNNING por documento) hace que un segundo
+  encolado no tenga efecto: retorna False si el documento ya tenía un trabajo activo.
+  """
+  # El Document puede estar recién agregado a la sesión: tiene que existir antes (FK)
+  session.flush()
+  now = datetime.now()
+  result = session.exec(
+    insert(IngestionJob)
+    .values(
+      document_id=document_id,
+      status=JobStatus.QUEUED.value,
+      attempts=0,
+      run_after=now,
+      created_at=now,
+      updated_at=now
+    )
+    .on_conflict_do_nothing()
+  )
+  return result.rowcount > 0
+
+
+def claim_job(worker_id: str) -> Optional[IngestionJob]:
+  """
+  Toma el siguiente trabajo disponible: encolado y vencido su backoff, o en curso con el
+  visibility timeout vencido (worker caído). SKIP LOCKED evita que dos workers tomen el mismo.
+  """
+  now = datetime.now()
+  with Session(engine) as session:
+    job = session.exec(
+      select(IngestionJob)
+      .where(or_(
+        and_(IngestionJob.status == JobStatus.QUEUED, IngestionJob.run_after <= now),
+        and_(IngestionJob.status == JobStatus.RUNNING, IngestionJob.locked_until < now)
+      ))
+      .order_by(IngestionJob.id)
+      .limit(1)
+      .with_for_update(skip_locked=True)
+    ).first()
+
+    if job is None:
+      return None
+
+    job.status = JobStatus.RUNNING
+    job.attempts += 1
+    job.locked_until = now + timedelta(seconds=INGESTION_VISIBILITY_TIMEOUT)
+    job.locked_by = worker_id
+    job.updated_at = now
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    return job
+
+
+def heartbeat(job_id: int, worker_id: str):
+  """Renueva el visibility timeout de un trabajo que sigue en curso"""
+  with Session(engine) as session:
+    session.exec(
+      update(IngestionJob)
+      .where(IngestionJob.id == job_id, IngestionJob.locked_by == worker_id, IngestionJob.status == JobStatus.RUNNING)
+      .values(locked_until=datetime.now() + timedelta(seconds=INGESTION_VISIBILITY_TIMEOUT))
+    )
+    session.commit()
+
+
+def _owned_by(job: IngestionJob):
+  """Solo el worker que tiene el trabajo puede cerrarlo: si su lease venció y otro lo retomó, no lo toca"""
+  return and_(
+    IngestionJob.id == job.id,
+    IngestionJob.locked_by == job.locked_by,
+    IngestionJob.status == JobStatus.RUNNING
+  )
+
+
+def complete_job(job: IngestionJob) -> bool:
+  with Session(engine) as session:
+    result = session.exec(
+      update(IngestionJob)
+      .where(_owned_by(job))
+      .values(status=JobStatus.DONE, locked_until=None, last_error=None, updated_at=datetime.now())
+    )
+    session.commit()
+  return result.rowcount > 0
+
+
+def fail_job(job: IngestionJob, error: str) -> bool:
+  """Reencola con backoff si quedan intentos; si no, el trabajo falla y el documento queda en ERROR"""
+  now = datetime.now()
+  retry = job.attempts < INGESTION_MAX_ATTEMPTS
+
+  with Session(engine) as session:
+    if retry:
+      result = session.exec(
+        update(IngestionJob)
+        .where(_owned_by(job))
+        .values(
+          status=JobStatus.QUEUED,
+          run_after=now + timedelta(seconds=INGESTION_RETRY_BASE_DELAY * 2 ** (job.attempts - 1)),
+          locked_until=None,
+          last_error=error[:1000],
+          updated_at=now
+        )
+      )
+      document_status = DocumentStatus.PENDING
+    else:
+      result = session.exec(
+        update(IngestionJob)
+        .where(_owned_by(job))
+        .values(status=JobStatus.FAILED, locked_until=None, last_error=error[:1000], updated_at=now)
+      )
+      document_status = DocumentStatus.ERROR
+
+    if result.rowcount == 0:
+      # Lease perdido: el trabajo ya es de otro worker y el estado del documento es suyo
+      session.rollback()
+      return False
+
+    session.exec(update(Document).where(Document.id == job.document_id).values(status=document_status))
+    session.commit()
+
+  INGESTION_DOCUMENTS.labels("retry" if retry else "error").inc()
+  return True
+
+
+def recover_stale_documents() -> int:
+  """
+  Al iniciar el worker: documentos PENDING o PROCESSING sin un trabajo activo (por ejemplo,
+  encolados antes de existir la cola o perdidos en un reinicio) vuelven a la cola.
+  Los trabajos RUNNING de un worker caído se retoman solos al vencer su visibility timeout.
+  """
+  active_job = exists().where(
+    IngestionJob.document_id == Document.id,
+    IngestionJob.status.in_([JobStatus.QUEUED, JobStatus.RUNNING])
+  )
+
+  with Session(engine) as session:
+    stale_ids = session.exec(
+      select(Document.id)
+      .where(Document.status.in_([DocumentStatus.PENDING, DocumentStatus.PROCESSING]))
+      .where(Document.deleted_at == None)
+      .where(~active_job)
+    ).all()
+
+    # Varios workers pueden recuperar a la vez: el índice único deja un solo trabajo por documento
+    enqueued = [document_id for document_id in stale_ids if enqueue_ingestion(session, document_id)]
+
+    if enqueued:
+      session.exec(update(Document).where(Document.id.in_(enqueued)).values(status=DocumentStatus.PENDING))
+    session.commit()
+
+  return len(enqueued)
@@ -0,0 +1,99 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+
+from database import engine, async_engine, pg_pool
+
+# Buckets pensados para etapas de chat: desde consultas de ms hasta respuestas largas de Gemini
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CHAT_STAGE_SECONDS = Histogram(
+  "chat_stage_seconds",
+  "Duración de cada etapa de una consulta de chat",
+  ["endpoint", "stage"],
+  buckets=STAGE_BUCKETS
+)
+
+WRITE_BEHIND_FLUSH_SECONDS = Histogram(
+  "write_behind_flush_seconds",
+  "Duración de cada escritura en lote de la cola diferida (el guardado de historial y logs del chat)",
+  buckets=STAGE_BUCKETS
+)
+
+INGESTION_DOCUMENTS = Counter(
+  "ingestion_documents_total",
+  "Documentos procesados por resultado",
+  ["status"]
+)
+INGESTION_PAGES = Counter("ingestion_pages_total", "Páginas de PDF leídas durante la ingesta")
+INGESTION_CHUNKS = Counter("ingestion_chunks_total", "Chunks vectorizados y guardados durante la ingesta")
+CHUNK_EMBEDDING_CACHE = Counter(
+  "chunk_embedding_cache_total",
+  "Chunks de la ingesta resueltos por la caché de embeddings (hit) o enviados a Gemini (miss)",
+  ["result"]
+)
+INGESTION_STAGE_SECONDS = Counter(
+  "ingestion_stage_seconds_total",
+  "Segundos ocupados por cada etapa del pipeline de ingesta",
+  ["stage"]
+)
+INGESTION_SECONDS = Histogram(
+  "ingestion_document_seconds",
+  "Duración del procesamiento completo de un documento",
+  buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 3600)
+)
+
+
+class StageTimer:
+  """Mide las etapas de un request; los tiempos se guardan en QueryLog.stage_timings"""
+
+  def __init__(self):
+    self.timings: dict = {}
+
+  @contextmanager
+  def stage(self, name: str):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.timings[name] = round(time.perf_counter() - start, 4)
+
+  def observe(self, endpoint: str):
+    for stage, seconds in self.timings.items():
+      CHAT_STAGE_SECONDS.labels(endpoint, stage).observe(seconds)
+
+
+class RuntimeCollector:
+  """Estado de los pools de conexiones y de la cola diferida, leído en cada scrape"""
+
+  def describe(self):
+    # Sin describe, REGISTRY.register llama a collect al importar este módulo y el import
+    # de write_behind (que importa este módulo) queda circular
+    return []
+
+  def collect(self):
+    pool_stats = pg_pool.get_stats()
+    pool = GaugeMetricFamily("db_pool_connections", "Conexiones del pool de psycopg", labels=["state"])
+    pool.add_metric(["size"], pool_stats.get("pool_size", 0))
+    pool.add_metric(["available"], pool_stats.get("pool_available", 0))
+    pool.add_metric(["waiting"], pool_stats.get("requests_waiting", 0))
+    yield pool
+
+    checked_out = GaugeMetricFamily(
+      "db_engine_connections_checked_out",
+      "Conexiones en uso de los motores de SQLAlchemy",
+      labels=["engine"]
+    )
+    checked_out.add_metric(["sync"], engine.pool.checkedout())
+    checked_out.add_metric(["async"], async_engine.pool.checkedout())
+    yield checked_out
+
+    # Import tardío: write_behind importa este módulo para medir sus escrituras
+    from services.write_behind import write_behind
+    stats = write_behind.stats()
+    yield GaugeMetricFamily("write_behind_queue_depth", "Registros esperando escritura diferida", value=stats["queue_depth"])
+
+
+REGISTRY.register(RuntimeCollector())
@@ -0,0 +1,20 @@
+from typing import List, Tuple
+
+from pypdf import PdfReader
+
+# Este módulo corre dentro de los procesos del pool de extracción: solo depende de pypdf.
+# Con spawn cada proceso importa además el script principal como __mp_main__; por eso worker.py
+# no importa nada pesado a nivel de módulo (el bucle vive en services.ingestion_worker).
+
+
+def count_pages(path: str) -> int:
+  return len(PdfReader(path).pages)
+
+
+def extract_page_range(path: str, start: int, end: int) -> List[Tuple[int, str]]:
+  """Texto de las páginas [start, end) como (índice, texto), igual que PyPDFLoader en modo página"""
+  reader = PdfReader(path)
+  return [
+    (page_index, reader.pages[page_index].extract_text(extraction_mode="plain").strip())
+    for page_index in range(start, end)
+  ]
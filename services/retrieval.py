@@ -0,0 +1,399 @@
+import os
+import re
+import time
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import Float, Text, bindparam, cast, func, literal_column, text, true, union_all
+from sqlalchemy.dialects.postgresql import ARRAY
+from pgvector.sqlalchemy import Vector
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from database import engine
+from models.chunk import DocumentChunk
+from models.services import Service, RetrievalMode, IterativeScan
+from services.vector_index import vector_index
+
+load_dotenv()
+
+# Constante k de Reciprocal Rank Fusion: score = sum(1 / (k + rank))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Candidatos que aporta cada lista (vectorial y léxica) antes de fusionar
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+# Segundos que se reutiliza la configuración de búsqueda de un servicio sin volver a leerla
+RETRIEVAL_SETTINGS_TTL = float(os.getenv("RETRIEVAL_SETTINGS_TTL", "60"))
+
+# Parámetros HNSW: construcción de los índices parciales y búsqueda (ef_search / iterative scan)
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+HNSW_EF_SEARCH = os.getenv("HNSW_EF_SEARCH")
+# off | strict_order | relaxed_order (requiere pgvector >= 0.8); un valor inválido falla al iniciar
+HNSW_ITERATIVE_SCAN = IterativeScan(os.getenv("HNSW_ITERATIVE_SCAN", "off"))
+
+# Columna generada tsvector (ver SCHEMA_UPDATES); no se mapea en el modelo para que el ORM nunca la escriba
+FULLTEXT_CONFIG = "spanish"
+content_tsv = literal_column("document_chunks.content_tsv")
+
+_settings_cache: dict = {}
+
+
+async def get_retrieval_settings(session: AsyncSession, service_id: int):
+  """Configuración de búsqueda del servicio, con una caché corta en memoria"""
+  cached = _settings_cache.get(service_id)
+  if cached and time.time() - cached[0] < RETRIEVAL_SETTINGS_TTL:
+    return cached[1]
+
+  settings = (await session.exec(
+    select(Service.retrieval_mode, Service.hnsw_ef_search, Service.hnsw_iterative_scan, Service.knowledge_updated_at)
+    .where(Service.id == service_id)
+  )).first()
+  _settings_cache[service_id] = (time.time(), settings)
+  return settings
+
+
+def clear_retrieval_settings(service_id: int):
+  _settings_cache.pop(service_id, None)
+
+
+def build_fulltext_terms(question: str) -> str:
+  """
+  Convierte la pregunta en una consulta OR para to_tsquery ('sap | me21n | error').
+  Solo se dejan palabras alfanuméricas, así nunca se genera una sintaxis inválida.
+  """
+  terms = []
+  for term in re.findall(r"\w+", question.lower()):
+    if len(term) > 1 and term not in terms:
+      terms.append(term)
+  return " | ".join(terms)
+
+
+def _is_hybrid(settings) -> bool:
+  return settings is not None and settings.retrieval_mode == RetrievalMode.HYBRID
+
+
+def _chunk_filters(service_id: int) -> list:
+  # service_id va como literal en el SQL para que el planner pueda elegir el índice HNSW parcial
+  # del servicio (con un parámetro genérico no puede probar que el predicado del índice se cumple)
+  return [
+    DocumentChunk.service_id == bindparam("chunk_service_id", int(service_id), literal_execute=True),
+    DocumentChunk.deleted_at == None
+  ]
+
+
+def service_vector_index_name(service_id: int) -> str:
+  return f"ix_document_chunks_embedding_service_{int(service_id)}"
+
+
+# Índice HNSW global de sql/database.sql, reemplazado por los índices parciales por servicio
+GLOBAL_VECTOR_INDEX = "document_chunks_embedding_idx"
+# Primer entero de pg_advisory_lock(int, int) para las construcciones de índices por servicio
+VECTOR_INDEX_LOCK_NAMESPACE = 8008
+
+
+def ensure_service_vector_index(service_id: int):
+  """
+  Crea (si no existe) el índice HNSW parcial con los chunks activos del servicio.
+  Un CREATE INDEX CONCURRENTLY interrumpido deja el índice INVALID: IF NOT EXISTS lo saltaría
+  para siempre, así que se revisa pg_index.indisvalid y se reconstruye.
+  """
+  service_id = int(service_id)
+  index_name = service_vector_index_name(service_id)
+  # CREATE INDEX CONCURRENTLY no puede correr dentro de una transacción
+  with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+    # Un servicio eliminado no vuelve a tener índice (delete_service lo acaba de borrar)
+    active = connection.execute(
+      select(Service.id).where(Service.id == service_id, Service.deleted_at == None)
+    ).first()
+    if active is None:
+      return
+
+    # Un solo constructor por servicio entre procesos: los demás esperan y encuentran el índice válido
+    # (así nadie borra como "inválido" un índice que otro está construyendo)
+    lock_params = {"namespace": VECTOR_INDEX_LOCK_NAMESPACE, "service_id": service_id}
+    connection.execute(text("SELECT pg_advisory_lock(:namespace, :service_id)"), lock_params)
+    try:
+      valid = connection.execute(text(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+      ), {"name": index_name}).scalar()
+      if valid:
+        return
+      if valid is not None:
+        print(f"Índice {index_name} inválido (construcción interrumpida): se reconstruye")
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+
+      connection.execute(text(
+        f"CREATE INDEX CONCURRENTLY {index_name} "
+        f"ON document_chunks USING hnsw (embedding vector_cosine_ops) "
+        f"WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION}) "
+        f"WHERE service_id = {service_id} AND deleted_at IS NULL"
+      ))
+    finally:
+      connection.execute(text("SELECT pg_advisory_unlock(:namespace, :service_id)"), lock_params)
+
+
+def drop_service_vector_index(service_id: int):
+  with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+    connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {service_vector_index_name(service_id)}"))
+
+
+def ensure_all_service_vector_indexes():
+  """
+  Lo llama worker.py al iniciar (en un hilo, sin frenar la API ni la cola) para los servicios que
+  ya existían antes de los índices parciales. Cuando todos quedan construidos se elimina el índice
+  HNSW global: toda búsqueda filtra por servicio y mantenerlo duplicaba el costo de cada inserción.
+  """
+  with engine.connect() as connection:
+    service_ids = connection.execute(
+      select(Service.id).where(Service.deleted_at == None)
+    ).scalars().all()
+
+  failed = 0
+  for service_id in service_ids:
+    try:
+      ensure_service_vector_index(service_id)
+    except Exception as e:
+      failed += 1
+      print(f"Error creando índice HNSW del servicio {service_id}: {str(e)}")
+
+  if failed == 0:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+      connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {GLOBAL_VECTOR_INDEX}"))
+
+
+async def apply_search_params(
+  session: AsyncSession,
+  settings,
+  ef_search: Optional[int] = None,
+  iterative_scan: Optional[IterativeScan] = None
+):
+  """
+  Ajusta hnsw.ef_search y hnsw.iterative_scan solo para la transacción actual (SET LOCAL).
+  Prioridad: parámetro de la consulta -> configuración del servicio -> variables de entorno.
+  """
+  if settings is not None:
+    ef_search = ef_search or settings.hnsw_ef_search
+    iterative_scan = iterative_scan or settings.hnsw_iterative_scan
+  ef_search = ef_search or (int(HNSW_EF_SEARCH) if HNSW_EF_SEARCH else None)
+  iterative_scan = IterativeScan(iterative_scan or HNSW_ITERATIVE_SCAN)
+
+  params = []
+  if ef_search:
+    params.append(func.set_config("hnsw.ef_search", str(int(ef_search)), True))
+  if iterative_scan != IterativeScan.OFF:
+    params.append(func.set_config("hnsw.iterative_scan", iterative_scan.value, True))
+
+  if params:
+    await session.exec(select(*params))
+
+
+def reciprocal_rank_fusion(rows, limit: int) -> list:
+  """
+  Fusiona las listas 'vector' y 'lexical' (cada una ya ordenada de mejor a peor) con RRF.
+  Las filas deben venir agrupadas por fuente y en orden de ranking.
+  """
+  scores = {}
+  best_rows = {}
+  ranks = {}
+
+  for row in rows:
+    rank = ranks.get(row.source, 0) + 1
+    ranks[row.source] = rank
+    scores[row.id] = scores.get(row.id, 0.0) + 1.0 / (RRF_K + rank)
+    best_rows.setdefault(row.id, row)
+
+  ordered_ids = sorted(scores, key=lambda chunk_id: scores[chunk_id], reverse=True)
+  return [best_rows[chunk_id] for chunk_id in ordered_ids[:limit]]
+
+
+async def search_chunks(
+  session: AsyncSession,
+  service_id: int,
+  query_vector: List[float],
+  question: Optional[str] = None,
+  limit: int = 5,
+  ef_search: Optional[int] = None,
+  iterative_scan: Optional[IterativeScan] = None
+) -> list:
+  """
+  Búsqueda de los fragmentos más relevantes del servicio ("Hard Filter" de servicio).
+  En modo híbrido combina la búsqueda vectorial con full-text search mediante RRF.
+  """
+  settings = await get_retrieval_settings(session, service_id)
+
+  # Servicios pequeños: producto punto sobre el índice mmap, sin ir a Postgres (si está al día)
+  if settings is not None and settings.retrieval_mode == RetrievalMode.MEMORY:
+    rows = vector_index.search(service_id, query_vector, limit, settings.knowledge_updated_at)
+    if rows is not None:
+      return rows
+
+  await apply_search_params(session, settings, ef_search, iterative_scan)
+  terms = build_fulltext_terms(question) if question else ""
+
+  distance = DocumentChunk.embedding.cosine_distance(query_vector)
+
+  if not _is_hybrid(settings) or not terms:
+    statement = (
+      select(
+        DocumentChunk.id,
+        DocumentChunk.document_id,
+        DocumentChunk.content,
+        DocumentChunk.page_number,
+        DocumentChunk.embedding
+      )
+      .where(*_chunk_filters(service_id))
+      .order_by(distance)
+      .limit(limit)
+    )
+    return (await session.exec(statement)).all()
+
+  # Modo híbrido: ambas listas en un solo round trip (UNION ALL) y la fusión en Python
+  tsquery = func.to_tsquery(FULLTEXT_CONFIG, terms)
+  lexical_rank = func.ts_rank_cd(content_tsv, tsquery)
+
+  vector_candidates = (
+    select(
+      literal_column("'vector'").label("source"),
+      DocumentChunk.id,
+      DocumentChunk.document_id,
+      DocumentChunk.content,
+      DocumentChunk.page_number,
+      DocumentChunk.embedding,
+      cast(distance, Float).label("sort_key")
+    )
+    .where(*_chunk_filters(service_id))
+    .order_by(distance)
+    .limit(HYBRID_CANDIDATES)
+    .subquery()
+  )
+  lexical_candidates = (
+    select(
+      literal_column("'lexical'").label("source"),
+      DocumentChunk.id,
+      DocumentChunk.document_id,
+      DocumentChunk.content,
+      DocumentChunk.page_number,
+      DocumentChunk.embedding,
+      (-lexical_rank).label("sort_key")
+    )
+    .where(*_chunk_filters(service_id))
+    .where(content_tsv.op("@@")(tsquery))
+    .order_by(lexical_rank.desc())
+    .limit(HYBRID_CANDIDATES)
+    .subquery()
+  )
+
+  candidates = union_all(select(vector_candidates), select(lexical_candidates)).subquery()
+  statement = select(candidates).order_by(candidates.c.source, candidates.c.sort_key)
+  rows = (await session.exec(statement)).all()
+  return reciprocal_rank_fusion(rows, limit)
+
+
+async def search_chunks_batch(
+  session: AsyncSession,
+  service_id: int,
+  query_vectors: List[List[float]],
+  questions: List[str],
+  limit: int = 5,
+  ef_search: Optional[int] = None,
+  iterative_scan: Optional[IterativeScan] = None
+) -> list:
+  """
+  Misma búsqueda que search_chunks pero para muchas preguntas en una sola consulta SQL:
+  unnest de los vectores + LATERAL join con el top-k de cada uno.
+  Retorna una lista de resultados por pregunta, en el mismo orden de query_vectors.
+  """
+  settings = await get_retrieval_settings(session, service_id)
+
+  if settings is not None and settings.retrieval_mode == RetrievalMode.MEMORY:
+    rows_by_question = [
+      vector_index.search(service_id, vector, limit, settings.knowledge_updated_at) for vector in query_vectors
+    ]
+    if all(rows is not None for rows in rows_by_question):
+      return rows_by_question
+
+  await apply_search_params(session, settings, ef_search, iterative_scan)
+  hybrid = _is_hybrid(settings)
+
+  vector_literals = ["[" + ",".join(str(x) for x in vector) + "]" for vector in query_vectors]
+  terms = [build_fulltext_terms(question) for question in questions]
+  queries = (
+    func.unnest(cast(vector_literals, ARRAY(Text)), cast(terms, ARRAY(Text)))
+    .table_valued("vector", "terms", with_ordinality="idx")
+    .render_derived(name="queries")
+  )
+
+  distance = DocumentChunk.embedding.cosine_distance(cast(queries.c.vector, Vector(768)))
+  top_vector = (
+    select(
+      DocumentChunk.id,
+      DocumentChunk.document_id,
+      DocumentChunk.content,
+      DocumentChunk.page_number,
+      DocumentChunk.embedding,
+      cast(distance, Float).label("sort_key")
+    )
+    .where(*_chunk_filters(service_id))
+    .order_by(distance)
+    .limit(HYBRID_CANDIDATES if hybrid else limit)
+    .lateral("top_vector")
+  )
+  branches = [
+    select(
+      queries.c.idx,
+      literal_column("'vector'").label("source"),
+      top_vector.c.id,
+      top_vector.c.document_id,
+      top_vector.c.content,
+      top_vector.c.page_number,
+      top_vector.c.embedding,
+      top_vector.c.sort_key
+    )
+    .select_from(queries)
+    .join(top_vector, true())
+  ]
+
+  if hybrid:
+    tsquery = func.to_tsquery(FULLTEXT_CONFIG, queries.c.terms)
+    lexical_rank = func.ts_rank_cd(content_tsv, tsquery)
+    top_lexical = (
+      select(
+        DocumentChunk.id,
+        DocumentChunk.document_id,
+        DocumentChunk.content,
+        DocumentChunk.page_number,
+        DocumentChunk.embedding,
+        (-lexical_rank).label("sort_key")
+      )
+      .where(*_chunk_filters(service_id))
+      .where(content_tsv.op("@@")(tsquery))
+      .order_by(lexical_rank.desc())
+      .limit(HYBRID_CANDIDATES)
+      .lateral("top_lexical")
+    )
+    branches.append(
+      select(
+        queries.c.idx,
+        literal_column("'lexical'").label("source"),
+        top_lexical.c.id,
+        top_lexical.c.document_id,
+        top_lexical.c.content,
+        top_lexical.c.page_number,
+        top_lexical.c.embedding,
+        top_lexical.c.sort_key
+      )
+      .select_from(queries)
+      .join(top_lexical, true())
+    )
+
+  candidates = union_all(*branches).subquery() if len(branches) > 1 else branches[0].subquery()
+  statement = select(candidates).order_by(candidates.c.idx, candidates.c.source, candidates.c.sort_key)
+
+  rows_by_question = [[] for _ in query_vectors]
+  for row in (await session.exec(statement)).all():
+    # WITH ORDINALITY empieza en 1
+    rows_by_question[row.idx - 1].append(row)
+
+  if not hybrid:
+    return rows_by_question
+  return [reciprocal_rank_fusion(rows, limit) for rows in rows_by_question]
@@ -1,46 +1,126 @@
+import asyncio
 import boto3
+import hashlib
 import os
+from typing import Tuple
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError
 from fastapi import UploadFile
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# S3 exige partes de al menos 5 MB (salvo la última)
+MIN_PART_SIZE = 5 * 1024 * 1024
+
 
 class S3Service:
   def __init__(self):
+    # Partes en vuelo por subida: la memoria por subida es como máximo part_size * concurrency
+    self.part_size = max(MIN_PART_SIZE, int(os.getenv("S3_UPLOAD_PART_SIZE", str(8 * 1024 * 1024))))
+    self.concurrency = int(os.getenv("S3_UPLOAD_CONCURRENCY", "4"))
+
     self.s3 = boto3.client(
       's3',
       aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
       aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-      region_name=os.getenv("AWS_REGION")
+      region_name=os.getenv("AWS_REGION"),
+      # Permite apuntar a un S3 local (MinIO, moto) para pruebas
+      endpoint_url=os.getenv("AWS_S3_ENDPOINT_URL") or None,
+      config=Config(max_pool_connections=int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32")))
     )
     self.bucket_name = os.getenv("AWS_S3_BUCKET")
 
-  def upload_file(self, file: UploadFile, s3_folder: str = "documents") -> str:
+  def content_prefix(self, content_hash: str, s3_folder: str = "documents") -> str:
+    """Carpeta de un contenido: todos los archivos con el mismo hash comparten el objeto"""
+    return f"{s3_folder}/{content_hash}/"
+
+  async def upload_stream(self, file: UploadFile, s3_key: str) -> Tuple[str, int]:
     """
-    Sube un archivo a S3 y retorna la s3_key (ruta).
+    Sube el archivo a S3 por partes (multipart upload) y retorna (md5, tamaño).
+    El MD5 se calcula a medida que se leen las partes y boto3 corre en hilos, fuera del
+    event loop. Se leen partes nuevas solo cuando hay un hueco entre las `concurrency` en vuelo.
     """
     try:
-      # Generamos la ruta dentro del bucket: ejemplo "documents/manual_sap.pdf"
-      file_name = file.filename
-      s3_key = f"{s3_folder}/{file_name}"
-
-      # Subir el archivo
-      self.s3.upload_fileobj(
-        file.file,
-        self.bucket_name,
-        s3_key,
-        ExtraArgs={"ContentType": file.content_type}  # Importante para que el navegador lo lea bien
+      upload = await asyncio.to_thread(
+        self.s3.create_multipart_upload,
+        Bucket=self.bucket_name,
+        Key=s3_key,
+        ContentType=file.content_type or "application/octet-stream"  # Importante para que el navegador lo lea bien
       )
-
-      return s3_key
-
     except NoCredentialsError:
       raise Exception("Credenciales de AWS no encontradas")
+
+    upload_id = upload["UploadId"]
+    md5 = hashlib.md5()
+    size = 0
+    slots = asyncio.Semaphore(self.concurrency)
+    tasks = []
+
+    async def upload_part(part_number: int, data: bytes) -> dict:
+      try:
+        response = await asyncio.to_thread(
+          self.s3.upload_part,
+          Bucket=self.bucket_name,
+          Key=s3_key,
+          UploadId=upload_id,
+          PartNumber=part_number,
+          Body=data
+        )
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+      finally:
+        slots.release()
+
+    try:
+      part_number = 1
+      while True:
+        await slots.acquire()
+        data = await file.read(self.part_size)
+        # Un archivo vacío se sube igual como una única parte vacía
+        if not data and part_number > 1:
+          slots.release()
+          break
+
+        # hashlib libera el GIL con bloques grandes: el hash no frena el event loop
+        await asyncio.to_thread(md5.update, data)
+        size += len(data)
+        tasks.append(asyncio.create_task(upload_part(part_number, data)))
+        part_number += 1
+
+        if len(data) < self.part_size:
+          break
+
+      parts = await asyncio.gather(*tasks)
+      await asyncio.to_thread(
+        self.s3.complete_multipart_upload,
+        Bucket=self.bucket_name,
+        Key=s3_key,
+        UploadId=upload_id,
+        MultipartUpload={"Parts": parts}
+      )
     except Exception as e:
+      for task in tasks:
+        task.cancel()
+      await asyncio.to_thread(
+        self.s3.abort_multipart_upload, Bucket=self.bucket_name, Key=s3_key, UploadId=upload_id
+      )
       raise Exception(f"Error al subir a S3: {str(e)}")
 
+    return md5.hexdigest(), size
+
+  def move_file(self, source_key: str, target_key: str):
+    """Copia dentro del bucket (sin pasar por este servidor) y borra el original"""
+    self.s3.copy_object(
+      Bucket=self.bucket_name,
+      Key=target_key,
+      CopySource={"Bucket": self.bucket_name, "Key": source_key},
+      MetadataDirective="COPY"
+    )
+    self.delete_file(source_key)
+
+  def delete_file(self, s3_key: str):
+    self.s3.delete_object(Bucket=self.bucket_name, Key=s3_key)
+
   def get_download_url(self, s3_key: str):
     """Genera una URL temporal (firmada) para descargar el archivo"""
     return self.s3.generate_presigned_url(
@@ -52,4 +132,3 @@ class S3Service:
 
 # Instancia global para usar en los routers
 s3_client = S3Service()
-
@@ -0,0 +1,46 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+  """
+  Coalescencia de trabajo en curso: si llegan varias llamadas con la misma llave mientras
+  la primera todavía corre, todas esperan el mismo resultado en vez de repetir el trabajo.
+  El resultado no se guarda: al terminar, la siguiente llamada vuelve a ejecutar.
+  """
+
+  def __init__(self):
+    self._calls: dict = {}
+    self.executions = 0
+    self.shared = 0
+
+  async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+    task = self._calls.get(key)
+    if task is None:
+      task = asyncio.create_task(factory())
+      self._calls[key] = task
+      task.add_done_callback(lambda done: self._finish(key, done))
+      self.executions += 1
+    else:
+      self.shared += 1
+
+    # shield: si un cliente se desconecta no se cancela el trabajo de los demás
+    return await asyncio.shield(task)
+
+  def _finish(self, key: Hashable, task: asyncio.Task):
+    if self._calls.get(key) is task:
+      del self._calls[key]
+    # Evita el aviso de "exception was never retrieved" si todos los que esperaban se fueron
+    if not task.cancelled():
+      task.exception()
+
+  def stats(self) -> dict:
+    return {
+      "in_flight": len(self._calls),
+      "executions": self.executions,
+      "shared": self.shared
+    }
+
+
+# Instancia global para usar en los routers
+single_flight = SingleFlight()
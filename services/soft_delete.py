@@ -0,0 +1,56 @@
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy import update
+from sqlmodel import Session
+
+from models.chunk import DocumentChunk
+from models.document import Document
+from models.services import Service
+
+# Borrado lógico en cascada con UPDATE por conjuntos: unas pocas sentencias sin importar
+# cuántos chunks haya. El commit lo hace quien llama, así todo queda en una transacción.
+# Los chunks se filtran por su propio service_id/document_id (sin JOIN ni cargar objetos);
+# al dejar de cumplir "deleted_at IS NULL" tampoco entran al índice HNSW parcial del servicio.
+
+
+def soft_delete_service(session: Session, service_id: int, now: Optional[datetime] = None) -> dict:
+  """Marca el servicio, sus documentos y sus chunks; retorna las filas afectadas por tabla"""
+  now = now or datetime.now()
+
+  services = session.exec(
+    update(Service)
+    .where(Service.id == service_id, Service.deleted_at == None)
+    .values(deleted_at=now)
+  ).rowcount
+  documents = session.exec(
+    update(Document)
+    .where(Document.service_id == service_id, Document.deleted_at == None)
+    .values(deleted_at=now)
+  ).rowcount
+  chunks = session.exec(
+    update(DocumentChunk)
+    .where(DocumentChunk.service_id == service_id, DocumentChunk.deleted_at == None)
+    .values(deleted_at=now)
+  ).rowcount
+
+  return {"services": services, "documents": documents, "chunks": chunks}
+
+
+def soft_delete_document(session: Session, document_id: UUID, now: Optional[datetime] = None) -> dict:
+  """Marca el documento y sus chunks; retorna las filas afectadas por tabla"""
+  now = now or datetime.now()
+
+  documents = session.exec(
+    update(Document)
+    .where(Document.id == document_id, Document.deleted_at == None)
+    .values(deleted_at=now)
+  ).rowcount
+  chunks = session.exec(
+    update(DocumentChunk)
+    .where(DocumentChunk.document_id == document_id, DocumentChunk.deleted_at == None)
+    .values(deleted_at=now)
+  ).rowcount
+
+  return {"documents": documents, "chunks": chunks}
@@ -0,0 +1,6 @@
+import json
+
+
+def format_sse(event: str, data: dict) -> str:
+  """Evento Server-Sent Events con datos JSON (lo usan los streams de chat y de progreso)"""
+  return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
@@ -0,0 +1,261 @@
+import asyncio
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlmodel import Session, select
+
+from database import engine
+from models.chunk import DocumentChunk
+from models.services import Service
+
+load_dotenv()
+
+
+class IndexedChunk(NamedTuple):
+  id: str
+  document_id: str
+  content: str
+  page_number: Optional[int]
+  embedding: np.ndarray
+
+
+class VectorIndex:
+  """
+  Índice vectorial de solo lectura en archivos memory-mapped, uno por servicio.
+  Postgres sigue siendo la fuente de verdad: cada manifiesto guarda la versión de conocimiento
+  (Service.knowledge_updated_at) con la que se construyó. Si la del servicio cambió (un documento
+  quedó READY en el worker, que puede estar en otra máquina), el índice no se usa y el proceso
+  web lo reconstruye en segundo plano desde Postgres.
+
+  Por servicio se guardan:
+    - service_{id}.{version}.npy : matriz (N x 768) normalizada, float32 o float16
+    - service_{id}.json          : manifiesto con la versión vigente y los metadatos de cada fila
+  El manifiesto se reemplaza de forma atómica, así los workers que leen nunca ven un estado a medias.
+  """
+
+  def __init__(self, directory: str, dtype: str = "float32"):
+    if dtype not in ("float32", "float16"):
+      raise ValueError(f"Tipo de dato no soportado para el índice vectorial: {dtype}")
+
+    self.directory = directory
+    self.dtype = np.dtype(dtype)
+    # service_id -> (versión del manifiesto, matriz mmap, filas, versión de conocimiento)
+    self._loaded: dict = {}
+    # Reconstrucciones en curso en este proceso, una por servicio
+    self._refreshing: dict = {}
+
+  # --- Lectura (cualquier worker) ---
+
+  def search(
+    self,
+    service_id: int,
+    query_vector: List[float],
+    limit: int = 5,
+    knowledge_version: Optional[datetime] = None
+  ) -> Optional[List[IndexedChunk]]:
+    """
+    Top-k por producto punto. None si el servicio no tiene índice cargado en este proceso o si se
+    construyó con otra versión de conocimiento: se usa pgvector mientras se carga o se reconstruye
+    en segundo plano. El manifiesto nunca se lee aquí (trae el texto de todos los chunks y
+    bloquearía el event loop); solo se comprueba con os.stat que lo cargado sigue vigente.
+    """
+    loaded = self._current(service_id)
+    if loaded is None or loaded[2] != self._stamp(knowledge_version):
+      self.refresh_in_background(service_id)
+      return None
+
+    matrix, rows, _ = loaded
+    if not rows:
+      return []
+
+    query = np.asarray(query_vector, dtype=np.float32)
+    norm = np.linalg.norm(query)
+    if norm > 0:
+      query = query / norm
+
+    # Los vectores ya están normalizados: el producto punto es la similitud coseno
+    scores = np.asarray(matrix, dtype=np.float32) @ query
+    k = min(limit, len(rows))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+
+    return [
+      IndexedChunk(rows[i]["id"], rows[i]["document_id"], rows[i]["content"], rows[i]["page_number"], matrix[i])
+      for i in top
+    ]
+
+  def _manifest_version(self, service_id: int):
+    # os.replace crea un inodo nuevo: inodo + mtime identifican la versión del manifiesto
+    try:
+      stat = os.stat(self._manifest_path(service_id))
+    except FileNotFoundError:
+      return None
+    return stat.st_ino, stat.st_mtime_ns
+
+  def _current(self, service_id: int):
+    """Lo ya cargado en este proceso, si sigue siendo la versión del manifiesto en disco"""
+    cached = self._loaded.get(service_id)
+    if cached and cached[0] == self._manifest_version(service_id):
+      return cached[1:]
+    return None
+
+  def _load(self, service_id: int):
+    """Carga el manifiesto y mapea su matriz (fuera del event loop: lo llama rebuild_service)"""
+    version = self._manifest_version(service_id)
+    if version is None:
+      self._loaded.pop(service_id, None)
+      return None
+
+    cached = self._loaded.get(service_id)
+    if cached and cached[0] == version:
+      return cached[1:]
+
+    try:
+      with open(self._manifest_path(service_id)) as manifest_file:
+        manifest = json.load(manifest_file)
+      matrix = np.load(os.path.join(self.directory, manifest["matrix"]), mmap_mode="r") if manifest["rows"] else None
+    except (FileNotFoundError, ValueError, KeyError) as e:
+      # Otro proceso reemplazó el manifiesto y borró la matriz anterior entre las dos lecturas
+      print(f"Índice en memoria del servicio {service_id} ilegible, se reconstruye: {str(e)}")
+      return None
+
+    self._loaded[service_id] = (version, matrix, manifest["chunks"], manifest.get("knowledge_version"))
+    return self._loaded[service_id][1:]
+
+  def refresh_in_background(self, service_id: int):
+    """
+    Agenda rebuild_service en un hilo (carga el manifiesto y, si está desactualizado, lo reconstruye);
+    si ya hay una en curso para el servicio no agenda otra
+    """
+    if service_id in self._refreshing:
+      return
+
+    task = asyncio.get_running_loop().create_task(asyncio.to_thread(self.rebuild_service, service_id))
+    self._refreshing[service_id] = task
+
+    def done(finished: asyncio.Task):
+      self._refreshing.pop(service_id, None)
+      if not finished.cancelled() and finished.exception():
+        print(f"Error reconstruyendo el índice en memoria del servicio {service_id}: {str(finished.exception())}")
+
+    task.add_done_callback(done)
+
+  # --- Escritura (quien procesa o elimina documentos) ---
+
+  def rebuild_service(self, service_id: int):
+    """
+    Reconstruye el índice del servicio completo desde Postgres. La versión de conocimiento se
+    lee antes que los chunks: si cambia en el medio, el índice queda con la versión vieja y la
+    próxima búsqueda lo vuelve a reconstruir. Si el manifiesto ya está al día no hace nada.
+    """
+    with self._service_lock(service_id):
+      with Session(engine) as session:
+        knowledge_version = self._stamp(
+          session.exec(select(Service.knowledge_updated_at).where(Service.id == service_id)).first()
+        )
+        loaded = self._load(service_id)
+        if loaded is not None and loaded[2] == knowledge_version:
+          return
+
+        chunks = session.exec(
+          select(DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.content,
+                 DocumentChunk.page_number, DocumentChunk.embedding)
+          .where(DocumentChunk.service_id == service_id)
+          .where(DocumentChunk.deleted_at == None)
+        ).all()
+
+      self._write(
+        service_id,
+        [self._row(c.id, c.document_id, c.content, c.page_number) for c in chunks],
+        [c.embedding for c in chunks],
+        knowledge_version
+      )
+
+  def remove_documents(self, service_id: int, document_ids: list):
+    """Quita del índice las filas de documentos eliminados o en reproceso"""
+    document_ids = {str(document_id) for document_id in document_ids}
+    with self._service_lock(service_id):
+      loaded = self._load(service_id)
+      if loaded is None:
+        return
+      matrix, rows, knowledge_version = loaded
+      keep = [i for i, row in enumerate(rows) if row["document_id"] not in document_ids]
+      if len(keep) == len(rows):
+        return
+      self._write(service_id, [rows[i] for i in keep], [matrix[i] for i in keep], knowledge_version)
+
+  def drop_service(self, service_id: int):
+    with self._service_lock(service_id):
+      manifest_path = self._manifest_path(service_id)
+      if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+      self._remove_old_matrices(service_id, keep=None)
+    self._loaded.pop(service_id, None)
+
+  def _write(self, service_id: int, rows: list, vectors: list, knowledge_version: Optional[str]):
+    os.makedirs(self.directory, exist_ok=True)
+    version = time.time_ns()
+    matrix_name = f"service_{service_id}.{version}.npy"
+
+    if rows:
+      matrix = np.asarray(vectors, dtype=np.float32).reshape(len(rows), -1)
+      norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+      matrix = matrix / np.where(norms > 0, norms, 1)
+      np.save(os.path.join(self.directory, matrix_name), matrix.astype(self.dtype))
+
+    manifest_path = self._manifest_path(service_id)
+    tmp_path = f"{manifest_path}.{version}.tmp"
+    with open(tmp_path, "w") as manifest_file:
+      json.dump({
+        "version": version,
+        "knowledge_version": knowledge_version,
+        "rows": len(rows),
+        "matrix": matrix_name,
+        "chunks": rows
+      }, manifest_file)
+    os.replace(tmp_path, manifest_path)
+
+    # Los workers que aún tengan mapeada la matriz anterior la siguen leyendo hasta recargar
+    self._remove_old_matrices(service_id, keep=matrix_name)
+
+  def _remove_old_matrices(self, service_id: int, keep: Optional[str]):
+    prefix = f"service_{service_id}."
+    for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+      if name.startswith(prefix) and name.endswith(".npy") and name != keep:
+        os.remove(os.path.join(self.directory, name))
+
+  @contextmanager
+  def _service_lock(self, service_id: int):
+    """Serializa a los escritores de un mismo servicio entre procesos"""
+    os.makedirs(self.directory, exist_ok=True)
+    with open(os.path.join(self.directory, f"service_{service_id}.lock"), "w") as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+  def _manifest_path(self, service_id: int) -> str:
+    return os.path.join(self.directory, f"service_{service_id}.json")
+
+  @staticmethod
+  def _stamp(knowledge_version: Optional[datetime]) -> Optional[str]:
+    return knowledge_version.isoformat() if knowledge_version else None
+
+  @staticmethod
+  def _row(chunk_id, document_id, content: str, page_number: Optional[int]) -> dict:
+    return {"id": str(chunk_id), "document_id": str(document_id), "content": content, "page_number": page_number}
+
+
+# Instancia global para usar en los routers
+vector_index = VectorIndex(
+  os.getenv("VECTOR_INDEX_DIR", "vector_index"),
+  dtype=os.getenv("VECTOR_INDEX_DTYPE", "float32")
+)
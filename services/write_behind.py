@@ -0,0 +1,159 @@
+import asyncio
+import os
+from typing import Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import insert
+
+from database import async_engine
+from models.query_log import QueryLog
+from services.chat_history import ChatHistoryStore, chat_history_store
+from services.history_compaction import HistoryCompactor, history_compactor
+from services.metrics import WRITE_BEHIND_FLUSH_SECONDS
+
+load_dotenv()
+
+
+class WriteBehindWriter:
+  """
+  Escritura diferida de lo que se guarda después de responder (QueryLog e historial de chat).
+  Los requests solo encolan; una tarea de fondo vacía la cola en INSERTs multi-fila cada
+  `flush_interval` segundos o al juntar `batch_size` registros. En el shutdown se vacía completa.
+  Si la cola está llena, quien encola espera (backpressure) en vez de perder registros.
+  Un lote que falla se reintenta `max_retries` veces con espera exponencial antes de descartarlo.
+  """
+
+  def __init__(
+    self,
+    history_store: ChatHistoryStore,
+    compactor: Optional[HistoryCompactor] = None,
+    batch_size: int = 200,
+    flush_interval: float = 0.5,
+    max_size: int = 10000,
+    max_retries: int = 5,
+    retry_base_delay: float = 0.5
+  ):
+    self.history_store = history_store
+    self.compactor = compactor
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    self.max_retries = max_retries
+    self.retry_base_delay = retry_base_delay
+    self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+    self._task: Optional[asyncio.Task] = None
+    self.flushed_records = 0
+    self.failed_records = 0
+
+  # --- Encolar (desde los routers) ---
+
+  async def add_query_log(self, log: QueryLog):
+    await self._queue.put(("query_log", log.model_dump()))
+
+  async def add_exchange(self, session_id: str, question: str, answer: str):
+    await self._queue.put(("chat_history", (session_id, question, answer)))
+
+  def stats(self) -> dict:
+    return {
+      "queue_depth": self._queue.qsize(),
+      "max_size": self._queue.maxsize,
+      "flushed_records": self.flushed_records,
+      "failed_records": self.failed_records
+    }
+
+  # --- Ciclo de vida (startup / shutdown de la app) ---
+
+  def start(self):
+    if self._task is None:
+      self._task = asyncio.create_task(self._run())
+
+  async def close(self, timeout: float = 30):
+    """Vacía la cola antes de cerrar el pool de conexiones"""
+    if self._task is None:
+      return
+    # None es la señal de cierre: todo lo encolado antes se escribe
+    await self._queue.put(None)
+    try:
+      await asyncio.wait_for(self._task, timeout)
+    except asyncio.TimeoutError:
+      print(f"Escritura diferida: {self._queue.qsize()} registros sin guardar al cerrar")
+    self._task = None
+
+  # --- Tarea de fondo ---
+
+  async def _run(self):
+    loop = asyncio.get_running_loop()
+    closing = False
+
+    while not closing:
+      item = await self._queue.get()
+      if item is None:
+        break
+
+      batch = [item]
+      deadline = loop.time() + self.flush_interval
+      while len(batch) < self.batch_size:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+          break
+        try:
+          item = await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+          break
+        if item is None:
+          closing = True
+          break
+        batch.append(item)
+
+      with WRITE_BEHIND_FLUSH_SECONDS.time():
+        await self._flush(batch)
+
+  async def _flush(self, batch: list):
+    logs = [record for kind, record in batch if kind == "query_log"]
+    exchanges = [record for kind, record in batch if kind == "chat_history"]
+
+    if exchanges and await self._write_with_retry(
+      lambda: self.history_store.add_exchanges(exchanges), len(exchanges), "historial de chat"
+    ):
+      if self.compactor:
+        for session_id in {session_id for session_id, _, _ in exchanges}:
+          self.compactor.schedule(session_id)
+
+    if logs:
+      await self._write_with_retry(lambda: self._insert_query_logs(logs), len(logs), "logs de consultas")
+
+  async def _insert_query_logs(self, logs: list):
+    # executemany de SQLAlchemy 2 se envía como INSERT ... VALUES multi-fila
+    async with async_engine.begin() as connection:
+      await connection.execute(insert(QueryLog), logs)
+
+  async def _write_with_retry(self, write, count: int, description: str) -> bool:
+    """
+    Cada INSERT es una sola sentencia: si falla no queda nada escrito y se puede repetir.
+    Mientras se reintenta la cola sigue creciendo y, si se llena, los requests esperan.
+    """
+    for attempt in range(self.max_retries + 1):
+      try:
+        await write()
+        self.flushed_records += count
+        return True
+      except Exception as e:
+        if attempt == self.max_retries:
+          self.failed_records += count
+          print(f"Error guardando {description} en lote, se descartan {count} registros: {str(e)}")
+          return False
+
+        delay = self.retry_base_delay * 2 ** attempt
+        print(f"Error guardando {description} en lote (reintento en {delay:.1f}s): {str(e)}")
+        await asyncio.sleep(delay)
+
+
+# Instancia global para usar en los routers
+write_behind = WriteBehindWriter(
+  chat_history_store,
+  compactor=history_compactor,
+  batch_size=int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200")),
+  flush_interval=float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.5")),
+  max_size=int(os.getenv("WRITE_BEHIND_MAX_SIZE", "10000")),
+  max_retries=int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "5")),
+  retry_base_delay=float(os.getenv("WRITE_BEHIND_RETRY_BASE_DELAY", "0.5"))
+)
@@ -45,8 +45,7 @@ CREATE TABLE document_chunks
 );
 
 -- 5. Índices para velocidad (HNSW es mucho más rápido que IVFFlat)
--- Esto hace que la búsqueda sea milisegundos incluso con millones de filas.
-CREATE INDEX ON document_chunks USING hnsw (embedding vector_cosine_ops);
+-- Los índices HNSW son parciales, uno por servicio (ver services/retrieval.py): los crea worker.py.
 
 -- Índice para que el filtrado por documento sea rápido al borrar
 CREATE INDEX ON document_chunks (document_id);
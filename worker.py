@@ -0,0 +1,9 @@
+import asyncio
+
+# Solo asyncio a nivel de módulo: los procesos spawn del pool de extracción re-importan este
+# archivo como __mp_main__ y no deben construir engines, pools ni clientes de Gemini/S3.
+
+
+if __name__ == "__main__":
+  from services.ingestion_worker import main
+  asyncio.run(main())